@@ -0,0 +1,490 @@
+# bench/fake_fleet.py
+"""
+Fake Timekpr fleet for benchmarking the sync engine.
+
+Responsibilities:
+- Generate N host trees with M users each from the files in template/
+- Serve every host as a local paramiko SSH/SFTP server on its own port
+- Run remote commands (stat, sha256sum, tar, sh -s) with a real shell
+  inside the host tree, with `timekpra` emulated by fake_timekpra.py
+- Inject latency and failures, and keep the stats files changing
+
+The host trees are real directories, so the remote paths in the generated
+servers.json are absolute paths below the fleet root.
+
+Usage:
+    python -m bench.fake_fleet --root /tmp/fleet --hosts 20 --users 3 \
+        --authorized-key /tmp/data/ssh_keys/bench_key.pub
+prints READY once listening and serves until stdin is closed.
+"""
+
+import os
+import sys
+import base64
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface, SFTP_OK, SFTP_PERMISSION_DENIED
+from paramiko.sftp import SFTP_NO_SUCH_FILE
+
+import logging
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+TEMPLATE_DIR = REPO_ROOT / "template"
+FAKE_TIMEKPRA = Path(__file__).resolve().parent / "fake_timekpra.py"
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@dataclass
+class FakeHost:
+    name: str
+    root: Path
+    users: list[str]
+    # seconds added to the handshake and to every exec / SFTP open and stat
+    latency: float = 0.0
+    # probability that an incoming connection is dropped right away
+    failure_rate: float = 0.0
+    # a down host is not listening at all
+    down: bool = False
+    port: int = 0
+    connections: int = field(default=0, compare=False)
+
+    def path(self, remote: str) -> Path:
+        return self.root / remote.lstrip("/")
+
+    def config_path(self) -> str:
+        return str(self.root / "etc/timekpr/timekpr.conf")
+
+    def user_config_path(self, user: str) -> str:
+        return str(self.root / f"var/lib/timekpr/config/timekpr.{user}.conf")
+
+    def stats_path(self, user: str) -> str:
+        return str(self.root / f"var/lib/timekpr/work/{user}.time")
+
+
+# -------------------------------------------------------------------
+# Host trees
+# -------------------------------------------------------------------
+
+def _render_stats(user: str, spent: int, playtime: int) -> str:
+    text = (TEMPLATE_DIR / "USER.time").read_text().replace("USER", user)
+    values = {
+        "TIME_SPENT_BALANCE": spent,
+        "TIME_SPENT_DAY": spent,
+        "TIME_SPENT_WEEK": spent * 3,
+        "TIME_SPENT_MONTH": spent * 10,
+        "LAST_CHECKED": datetime.now().strftime(TIME_FORMAT),
+        "PLAYTIME_SPENT_BALANCE": playtime,
+        "PLAYTIME_SPENT_DAY": playtime,
+    }
+    lines = []
+    for line in text.splitlines():
+        key = line.split("=", 1)[0].strip()
+        if "=" in line and key in values:
+            line = f"{key} = {values[key]}"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def generate_host(host: FakeHost) -> None:
+    config = host.path("/etc/timekpr/timekpr.conf")
+    config.parent.mkdir(parents=True, exist_ok=True)
+    config.write_text((TEMPLATE_DIR / "timekpr.conf").read_text())
+
+    for user in host.users:
+        user_config = Path(host.user_config_path(user))
+        user_config.parent.mkdir(parents=True, exist_ok=True)
+        user_config.write_text((TEMPLATE_DIR / "timekpr.USER.conf").read_text().replace("USER", user))
+
+        stats = Path(host.stats_path(user))
+        stats.parent.mkdir(parents=True, exist_ok=True)
+        stats.write_text(_render_stats(user, random.randint(0, 7200), random.randint(0, 1800)))
+
+
+def tick_user(host: FakeHost, user: str, seconds: int) -> None:
+    """
+    Let a user spend `seconds`, the way timekpr rewrites the .time file.
+    """
+    path = Path(host.stats_path(user))
+    values = {}
+    for line in path.read_text().splitlines():
+        if "=" in line and not line.startswith("#"):
+            key, value = line.split("=", 1)
+            values[key.strip()] = value.strip()
+    spent = int(values.get("TIME_SPENT_DAY", 0)) + seconds
+    playtime = int(values.get("PLAYTIME_SPENT_DAY", 0)) + seconds // 2
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(_render_stats(user, spent, playtime))
+    tmp.replace(path)
+
+
+def _write_timekpra_shim(bin_dir: Path) -> None:
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    shim = bin_dir / "timekpra"
+    shim.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_TIMEKPRA}" "$@"\n')
+    shim.chmod(0o755)
+
+
+# -------------------------------------------------------------------
+# SSH server side
+# -------------------------------------------------------------------
+
+class _HostServer(paramiko.ServerInterface):
+    def __init__(self, fleet: "FakeFleet", host: FakeHost):
+        self.fleet = fleet
+        self.host = host
+
+    def get_allowed_auths(self, username):
+        return "publickey"
+
+    def check_auth_publickey(self, username, key):
+        if key == self.fleet.authorized_key:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(
+            target=self.fleet.run_command,
+            args=(self.host, channel, command.decode()),
+            daemon=True,
+            name=f"fake-exec-{self.host.name}",
+        ).start()
+        return True
+
+
+class _SFTPHandle(SFTPHandle):
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class _HostSFTP(SFTPServerInterface):
+    """
+    SFTP on the real files of one host tree; paths outside of it are refused.
+    """
+
+    def __init__(self, server: _HostServer, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.host = server.host
+
+    def _local(self, path: str) -> Path | None:
+        resolved = Path(os.path.normpath(path))
+        if resolved != self.host.root and self.host.root not in resolved.parents:
+            return None
+        return resolved
+
+    def _delay(self) -> None:
+        if self.host.latency:
+            time.sleep(self.host.latency)
+
+    def stat(self, path):
+        self._delay()
+        local = self._local(path)
+        if local is None:
+            return SFTP_PERMISSION_DENIED
+        try:
+            return SFTPAttributes.from_stat(local.stat())
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def canonicalize(self, path):
+        return os.path.normpath(path if path.startswith("/") else str(self.host.root / path))
+
+    def open(self, path, flags, attr):
+        self._delay()
+        local = self._local(path)
+        if local is None:
+            return SFTP_PERMISSION_DENIED
+        try:
+            fd = os.open(local, flags, 0o644)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        handle = _SFTPHandle(flags)
+        f = os.fdopen(fd, mode)
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        local = self._local(path)
+        if local is None:
+            return SFTP_PERMISSION_DENIED
+        try:
+            local.unlink()
+        except FileNotFoundError:
+            return SFTP_NO_SUCH_FILE
+        return SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        old, new = self._local(oldpath), self._local(newpath)
+        if old is None or new is None:
+            return SFTP_PERMISSION_DENIED
+        try:
+            old.rename(new)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def chattr(self, path, attr):
+        local = self._local(path)
+        if local is None:
+            return SFTP_PERMISSION_DENIED
+        try:
+            if attr.st_atime is not None and attr.st_mtime is not None:
+                os.utime(local, (attr.st_atime, attr.st_mtime))
+            if attr.st_mode is not None:
+                os.chmod(local, attr.st_mode & 0o7777)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+
+class FakeFleet:
+    def __init__(
+        self,
+        root: Path,
+        *,
+        hosts: int,
+        users: int,
+        authorized_key: paramiko.PKey,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        down: int = 0,
+    ):
+        self.root = root
+        self.authorized_key = authorized_key
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.bin_dir = root / "bin"
+        self.hosts = [
+            FakeHost(
+                name=f"host{i:03d}",
+                root=root / f"host{i:03d}",
+                users=[f"user{j:02d}" for j in range(users)],
+                latency=latency,
+                failure_rate=failure_rate,
+                down=i < down,
+            )
+            for i in range(hosts)
+        ]
+        self._sockets: list[socket.socket] = []
+        self._stop = threading.Event()
+
+    # ---------------------------------------------------------------
+    # Lifecycle
+    # ---------------------------------------------------------------
+
+    def start(self) -> None:
+        _write_timekpra_shim(self.bin_dir)
+        for host in self.hosts:
+            generate_host(host)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(("127.0.0.1", 0))
+            host.port = sock.getsockname()[1]
+            if host.down:
+                # reserve a port nobody listens on
+                sock.close()
+                continue
+            sock.listen(64)
+            self._sockets.append(sock)
+            threading.Thread(target=self._accept_loop, args=(host, sock), daemon=True,
+                             name=f"fake-accept-{host.name}").start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        for sock in self._sockets:
+            sock.close()
+
+    def servers_json(self, key_name: str) -> dict:
+        """
+        servers.json content pointing the sync engine at this fleet.
+        """
+        return {
+            host.name: {
+                "host": "127.0.0.1",
+                "port": host.port,
+                "user": "bench",
+                "key": key_name,
+                "server_config": host.config_path(),
+                "users": {
+                    user: {"config": host.user_config_path(user), "stats": host.stats_path(user)}
+                    for user in host.users
+                },
+            }
+            for host in self.hosts
+        }
+
+    def churn(self, fraction: float, seconds: int = 60) -> int:
+        """
+        Let a random fraction of the users spend time. Returns the number of touched files.
+        """
+        touched = 0
+        for host in self.hosts:
+            for user in host.users:
+                if random.random() < fraction:
+                    tick_user(host, user, seconds)
+                    touched += 1
+        return touched
+
+    # ---------------------------------------------------------------
+    # Connections
+    # ---------------------------------------------------------------
+
+    def _accept_loop(self, host: FakeHost, sock: socket.socket) -> None:
+        while not self._stop.is_set():
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return
+            host.connections += 1
+            if host.failure_rate and random.random() < host.failure_rate:
+                conn.close()
+                continue
+            threading.Thread(target=self._serve, args=(host, conn), daemon=True,
+                             name=f"fake-conn-{host.name}").start()
+
+    def _serve(self, host: FakeHost, conn: socket.socket) -> None:
+        if host.latency:
+            time.sleep(host.latency)
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler("sftp", SFTPServer, _HostSFTP)
+        try:
+            transport.start_server(server=_HostServer(self, host))
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            logger.debug(f"[{host.name}] handshake failed: {e}")
+            transport.close()
+            return
+        # the transport thread serves the channels (exec and sftp are started from the
+        # ServerInterface callbacks); do not accept() them, a dropped Channel object closes itself
+        while transport.is_active() and not self._stop.wait(1):
+            pass
+        transport.close()
+
+    def run_command(self, host: FakeHost, channel: paramiko.Channel, command: str) -> None:
+        """
+        Run an exec request with a real shell inside the host tree.
+        """
+        if host.latency:
+            time.sleep(host.latency)
+        env = dict(os.environ)
+        env["PATH"] = f"{self.bin_dir}{os.pathsep}{env.get('PATH', '')}"
+        env["FAKE_TIMEKPR_ROOT"] = str(host.root)
+        proc = subprocess.Popen(
+            ["sh", "-c", command],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=host.root,
+            env=env,
+        )
+
+        def pump_stdin():
+            try:
+                while True:
+                    data = channel.recv(32768)
+                    if not data:
+                        break
+                    proc.stdin.write(data)
+                    proc.stdin.flush()
+            except (OSError, ValueError):
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+
+        def pump_stderr():
+            for chunk in iter(lambda: proc.stderr.read1(32768), b""):
+                channel.sendall_stderr(chunk)
+
+        threads = [threading.Thread(target=pump_stdin, daemon=True), threading.Thread(target=pump_stderr, daemon=True)]
+        for thread in threads:
+            thread.start()
+        try:
+            for chunk in iter(lambda: proc.stdout.read1(32768), b""):
+                channel.sendall(chunk)
+            status = proc.wait()
+            threads[1].join()
+            channel.send_exit_status(status)
+        except OSError:
+            proc.kill()
+        finally:
+            channel.close()
+
+
+# -------------------------------------------------------------------
+# CLI
+# -------------------------------------------------------------------
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a fake Timekpr fleet over SSH")
+    parser.add_argument("--root", type=Path, required=True, help="directory for the host trees")
+    parser.add_argument("--hosts", type=int, default=5)
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--authorized-key", type=Path, required=True, help="public key (OpenSSH format) to accept")
+    parser.add_argument("--key-name", default="bench_key", help="key file name written into servers.json")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per handshake / command / SFTP open")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of connections dropped")
+    parser.add_argument("--down", type=int, default=0, help="number of hosts not listening at all")
+    parser.add_argument("--churn", type=float, default=0.0, help="share of users ticking per churn interval")
+    parser.add_argument("--churn-interval", type=float, default=5.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "warning").upper())
+    # the engine's TCP reachability probe closes without an SSH banner, which paramiko logs as an error
+    logging.getLogger("paramiko.transport").setLevel(logging.CRITICAL)
+    key_type, key_data = args.authorized_key.read_text().split()[:2]
+    authorized = paramiko.PKey.from_type_string(key_type, base64.b64decode(key_data))
+
+    fleet = FakeFleet(
+        args.root,
+        hosts=args.hosts,
+        users=args.users,
+        authorized_key=authorized,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        down=args.down,
+    )
+    fleet.start()
+    (args.root / "servers.json").write_text(json.dumps(fleet.servers_json(args.key_name), indent=2))
+
+    if args.churn:
+        def churn_loop():
+            while not fleet._stop.wait(args.churn_interval):
+                fleet.churn(args.churn, int(args.churn_interval))
+        threading.Thread(target=churn_loop, daemon=True, name="fake-churn").start()
+
+    print("READY", flush=True)
+    # serve until the parent closes our stdin (or we get killed)
+    sys.stdin.read()
+    fleet.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# bench/fake_timekpra.py
+"""
+Stand-in for the `timekpra` admin CLI on the fake fleet hosts.
+
+Run as a plain script (the fleet puts a `timekpra` shim on the PATH of every
+remote command); the host's file tree is taken from $FAKE_TIMEKPR_ROOT.
+
+Supported:
+    timekpra --getuserinfo USER
+    timekpra --settimeleft USER {+|-|=} SECONDS
+    timekpra --setplaytimeleft USER {+|-|=} SECONDS
+"""
+
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def stats_file(user: str) -> Path:
+    return Path(os.environ["FAKE_TIMEKPR_ROOT"]) / "var/lib/timekpr/work" / f"{user}.time"
+
+
+def read_values(path: Path) -> tuple[list[str], dict[str, str]]:
+    lines = path.read_text().splitlines()
+    values = {}
+    for line in lines:
+        if "=" in line and not line.startswith("#"):
+            key, value = line.split("=", 1)
+            values[key.strip()] = value.strip()
+    return lines, values
+
+
+def write_values(path: Path, lines: list[str], values: dict[str, str]) -> None:
+    out = []
+    for line in lines:
+        if "=" in line and not line.startswith("#"):
+            key = line.split("=", 1)[0].strip()
+            line = f"{key} = {values[key]}"
+        out.append(line)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text("\n".join(out) + "\n")
+    tmp.replace(path)
+
+
+def renew_day(values: dict[str, str]) -> None:
+    """
+    Like timekpr on first contact of a new day: reset the daily counters.
+    """
+    now = datetime.now()
+    checked = datetime.strptime(values.get("LAST_CHECKED", "2000-01-01 00:00:00"), TIME_FORMAT)
+    if checked.date() != now.date():
+        for key in ("TIME_SPENT_BALANCE", "TIME_SPENT_DAY", "PLAYTIME_SPENT_BALANCE", "PLAYTIME_SPENT_DAY"):
+            if key in values:
+                values[key] = "0"
+    values["LAST_CHECKED"] = now.strftime(TIME_FORMAT)
+
+
+def adjust(values: dict[str, str], key: str, operation: str, seconds: int) -> None:
+    # more time left means less spent balance
+    balance = int(values.get(key, 0))
+    if operation == "+":
+        balance -= seconds
+    elif operation == "-":
+        balance += seconds
+    else:
+        balance = -seconds
+    values[key] = str(balance)
+
+
+def main(argv: list[str]) -> int:
+    if len(argv) < 2:
+        print("usage: timekpra --getuserinfo USER | --settimeleft USER OP SECONDS", file=sys.stderr)
+        return 2
+
+    option, user = argv[0], argv[1]
+    path = stats_file(user)
+    if not path.exists():
+        print(f"user {user} not found", file=sys.stderr)
+        return 1
+
+    lines, values = read_values(path)
+    renew_day(values)
+
+    if option == "--getuserinfo":
+        for key, value in values.items():
+            print(f"{key}: {value}")
+    elif option in ("--settimeleft", "--setplaytimeleft") and len(argv) == 4:
+        operation, seconds = argv[2], argv[3]
+        if operation not in ("+", "-", "=") or not seconds.isdigit():
+            print(f"invalid arguments: {operation} {seconds}", file=sys.stderr)
+            return 2
+        key = "TIME_SPENT_BALANCE" if option == "--settimeleft" else "PLAYTIME_SPENT_BALANCE"
+        adjust(values, key, operation, int(seconds))
+    else:
+        print(f"unsupported option: {option}", file=sys.stderr)
+        return 2
+
+    write_values(path, lines, values)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
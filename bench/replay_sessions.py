@@ -0,0 +1,92 @@
+# bench/replay_sessions.py
+"""
+Replay recorded SSH sessions through the sync engine.
+
+A recording is made by setting `sync.record_dir` in the add-on options
+(see ssh_recorder.py). Replaying it runs `run_sync_loop_with_stop` without
+any network, answering every SSH operation from the recording, and reports
+cycle time, per-phase percentiles and CPU time. With --latency-scale 1 the
+recorded latencies are replayed as well.
+
+Usage:
+    python -m bench.replay_sessions /share/timekpr-recording --output replay.json
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+
+def replay(recording: Path, cycles: int | None, latency_scale: float, workers: int | None, cycle_timeout: float) -> dict:
+    with tempfile.TemporaryDirectory(prefix="timekpr-replay-") as tmp:
+        data_root = Path(tmp)
+        shutil.copyfile(recording / "servers.json", data_root / "servers.json")
+
+        # same engine options as when recording (bundle, probe_hash, ... decide the remote commands)
+        options_file = recording / "sync_options.json"
+        sync_options = json.loads(options_file.read_text()) if options_file.exists() else {}
+        sync_options.pop("record_dir", None)
+        sync_options["trigger_debounce"] = 0
+        if workers is not None:
+            sync_options["max_workers"] = workers
+        (data_root / "options.json").write_text(json.dumps({"sync": sync_options}))
+        # storage reads the data root at import time
+        os.environ["TIMEKPR_MNGR_DATA_ROOT"] = str(data_root)
+
+        import ssh_sync
+        from ssh_recorder import SessionReplayer
+        from sync_trace import tracer
+        from bench.run_sync_bench import run_engine
+
+        replayer = SessionReplayer(recording, latency_scale=latency_scale)
+        # the replayer stands in for the real SSH connect; pool, tracing and metrics stay in place
+        ssh_sync._connect = replayer.connect
+
+        if cycles is None:
+            cycles = max((replayer.probe_count(name) for name in replayer.servers()), default=1) or 1
+        result = run_engine(cycles, 0.0, cycle_timeout)
+
+    result.update({
+        "recording": str(recording),
+        "latency_scale": latency_scale,
+        "phases": tracer.phase_percentiles(),
+        "unmatched": replayer.unmatched,
+    })
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay recorded SSH sessions through the sync engine")
+    parser.add_argument("recording", type=Path, help="directory written with sync.record_dir")
+    parser.add_argument("--cycles", type=int, help="cycles to run (default: as many as were recorded)")
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="0: full speed, 1: recorded latency")
+    parser.add_argument("--workers", type=int, help="sync.max_workers (default: as recorded)")
+    parser.add_argument("--cycle-timeout", type=float, default=300.0)
+    parser.add_argument("--log-level", default="warning")
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    import logging
+    logging.basicConfig(level=args.log_level.upper(), stream=sys.stderr)
+
+    result = replay(args.recording, args.cycles, args.latency_scale, args.workers, args.cycle_timeout)
+
+    print(f"{result['cycles']} cycle(s): first {result['first_cycle'] or 0:.3f}s, "
+          f"p50 {result['cycle_p50'] or 0:.3f}s, max {result['cycle_max'] or 0:.3f}s, cpu {result['cpu_seconds']:.2f}s")
+    for phase, summary in result["phases"].items():
+        print(f"  {phase:<16} n={summary['count']:<5} p50={summary['p50']:.4f}s p90={summary['p90']:.4f}s total={summary['total']:.3f}s")
+    if result["unmatched"]:
+        print(f"{sum(result['unmatched'].values())} operation(s) had no recorded answer:")
+        for name, count in sorted(result["unmatched"].items()):
+            print(f"  {count:>4} x {name}")
+
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# bench/run_sync_bench.py
+"""
+Sync engine benchmark against the fake fleet.
+
+For every fleet size a fake fleet (bench/fake_fleet.py) and a fresh sync engine
+are started in their own processes; the engine runs `run_sync_loop_with_stop`
+for a number of full cycles and reports cycle time, SSH connections, files and
+bytes transferred and CPU time.
+
+Usage:
+    python -m bench.run_sync_bench --sizes 1,10,50 --users 3 --cycles 5 \
+        --latency 0.02 --churn 0.3 --output bench_results.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from statistics import mean, median
+
+import paramiko
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+KEY_NAME = "bench_key"
+
+
+# -------------------------------------------------------------------
+# Engine side (runs in the child process, DATA_ROOT points at the bench dir)
+# -------------------------------------------------------------------
+
+def _write_grants(fraction: float) -> int:
+    """
+    Queue extra time for a random fraction of the users, like the UI does.
+    """
+    from servers import load_servers
+    from storage import pending_stats_dir
+
+    queued = 0
+    for server_name, server in load_servers().items():
+        for user in server.get("users", {}):
+            if random.random() < fraction:
+                target = pending_stats_dir(server_name) / f"{user}.stats"
+                target.write_text(
+                    f'timekpra --settimeleft "{user}" "+" "900"\n'
+                    f'timekpra --setplaytimeleft "{user}" "+" "300"\n'
+                )
+                queued += 1
+    return queued
+
+
+def run_engine(cycles: int, grant_rate: float, cycle_timeout: float) -> dict:
+    import ssh_sync
+    from metrics import SYNC_CYCLES, SSH_CONNECT_FAILURES, TRANSFER_BYTES, TRANSFER_FILES
+    from sync_trace import tracer, CYCLE_PHASE
+
+    stop_event = threading.Event()
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    grants = _write_grants(grant_rate)
+
+    # a long interval: after the first cycle only our triggers start new ones
+    thread = threading.Thread(target=ssh_sync.run_sync_loop_with_stop, args=(stop_event, 3600), daemon=True)
+    thread.start()
+
+    completed = 0
+    for i in range(1, cycles + 1):
+        if i > 1:
+            grants += _write_grants(grant_rate)
+            ssh_sync.trigger_ssh_sync()
+        deadline = time.monotonic() + cycle_timeout
+        while SYNC_CYCLES.total() < i and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if SYNC_CYCLES.total() < i:
+            break
+        completed = i
+
+    stop_event.set()
+    ssh_sync.trigger_event.set()
+    thread.join(timeout=10)
+
+    durations = [s.duration for s in tracer.spans() if s.phase == CYCLE_PHASE]
+    spans = tracer.spans()
+    return {
+        "cycles": completed,
+        "first_cycle": durations[0] if durations else None,
+        "cycle_mean": mean(durations) if durations else None,
+        "cycle_p50": median(durations) if durations else None,
+        "cycle_max": max(durations) if durations else None,
+        "connections": sum(1 for s in spans if s.phase == "connect"),
+        "connect_failures": SSH_CONNECT_FAILURES.total(),
+        "files": TRANSFER_FILES.total(),
+        "bytes": TRANSFER_BYTES.total(),
+        "grants": grants,
+        "cpu_seconds": time.process_time() - cpu_start,
+        "wall_seconds": time.monotonic() - wall_start,
+        "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+# -------------------------------------------------------------------
+# Orchestration
+# -------------------------------------------------------------------
+
+def _prepare_data_root(data_root: Path, sync_options: dict) -> Path:
+    keys_dir = data_root / "ssh_keys"
+    keys_dir.mkdir(parents=True)
+    key = paramiko.RSAKey.generate(2048)
+    key.write_private_key_file(str(keys_dir / KEY_NAME))
+    public = keys_dir / f"{KEY_NAME}.pub"
+    public.write_text(f"{key.get_name()} {key.get_base64()}\n")
+    (data_root / "options.json").write_text(json.dumps({"sync": sync_options}))
+    return public
+
+
+def run_size(hosts: int, args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory(prefix="timekpr-bench-") as tmp:
+        tmp = Path(tmp)
+        data_root = tmp / "data"
+        fleet_root = tmp / "fleet"
+        fleet_root.mkdir()
+        sync_options = {
+            "max_workers": args.workers,
+            "bundle": not args.no_bundle,
+            "trigger_debounce": 0,
+        }
+        if args.record:
+            sync_options["record_dir"] = str((args.record / f"{hosts}_hosts").resolve())
+        public_key = _prepare_data_root(data_root, sync_options)
+
+        fleet = subprocess.Popen(
+            [
+                sys.executable, "-m", "bench.fake_fleet",
+                "--root", str(fleet_root),
+                "--hosts", str(hosts),
+                "--users", str(args.users),
+                "--authorized-key", str(public_key),
+                "--key-name", KEY_NAME,
+                "--latency", str(args.latency),
+                "--failure-rate", str(args.failure_rate),
+                "--down", str(args.down),
+                "--churn", str(args.churn),
+                "--churn-interval", str(args.churn_interval),
+            ],
+            cwd=REPO_ROOT,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        try:
+            if fleet.stdout.readline().strip() != "READY":
+                raise RuntimeError("fake fleet did not start")
+            (data_root / "servers.json").write_text((fleet_root / "servers.json").read_text())
+
+            env = dict(os.environ, TIMEKPR_MNGR_DATA_ROOT=str(data_root), LOG_LEVEL=args.log_level)
+            engine = subprocess.run(
+                [
+                    sys.executable, "-m", "bench.run_sync_bench", "--engine",
+                    "--cycles", str(args.cycles),
+                    "--grant-rate", str(args.grant_rate),
+                    "--cycle-timeout", str(args.cycle_timeout),
+                    "--log-level", args.log_level,
+                ],
+                cwd=REPO_ROOT,
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+            if engine.returncode != 0:
+                raise RuntimeError(f"sync engine failed:\n{engine.stderr}")
+            sys.stderr.write(engine.stderr)
+            result = json.loads(engine.stdout.strip().splitlines()[-1])
+        finally:
+            fleet.stdin.close()
+            try:
+                fleet.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                fleet.kill()
+
+    result.update({"hosts": hosts, "users": args.users, "latency": args.latency})
+    return result
+
+
+def _fmt(value, pattern: str) -> str:
+    return "-" if value is None else pattern.format(value)
+
+
+def print_table(results: list[dict]) -> None:
+    header = f"{'hosts':>6} {'cycles':>6} {'first':>8} {'p50':>8} {'max':>8} {'conns':>6} {'files':>6} {'bytes':>10} {'cpu':>7}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['hosts']:>6} {r['cycles']:>6} {_fmt(r['first_cycle'], '{:.2f}s'):>8} "
+            f"{_fmt(r['cycle_p50'], '{:.2f}s'):>8} {_fmt(r['cycle_max'], '{:.2f}s'):>8} "
+            f"{r['connections']:>6} {int(r['files']):>6} {int(r['bytes']):>10} {r['cpu_seconds']:>6.2f}s"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the sync engine against a fake fleet")
+    parser.add_argument("--sizes", default="1,10,50", help="comma separated fleet sizes (hosts)")
+    parser.add_argument("--users", type=int, default=3, help="users per host")
+    parser.add_argument("--cycles", type=int, default=5, help="full sync cycles per fleet size")
+    parser.add_argument("--workers", type=int, default=8, help="sync.max_workers")
+    parser.add_argument("--no-bundle", action="store_true", help="disable tar bundle downloads")
+    parser.add_argument("--latency", type=float, default=0.0, help="injected seconds per remote operation")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of dropped SSH connections")
+    parser.add_argument("--down", type=int, default=0, help="hosts that are offline")
+    parser.add_argument("--churn", type=float, default=0.3, help="share of users whose stats change per interval")
+    parser.add_argument("--churn-interval", type=float, default=1.0)
+    parser.add_argument("--grant-rate", type=float, default=0.1, help="share of users getting extra time per cycle")
+    parser.add_argument("--cycle-timeout", type=float, default=300.0)
+    parser.add_argument("--log-level", default="warning")
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    parser.add_argument("--record", type=Path, help="record the SSH sessions to DIR/<hosts>_hosts for replay")
+    parser.add_argument("--engine", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.engine:
+        import logging
+        logging.basicConfig(level=args.log_level.upper(), stream=sys.stderr)
+        print(json.dumps(run_engine(args.cycles, args.grant_rate, args.cycle_timeout)))
+        return
+
+    results = []
+    for hosts in (int(size) for size in args.sizes.split(",")):
+        print(f"fleet of {hosts} host(s) x {args.users} user(s) ...", file=sys.stderr, flush=True)
+        results.append(run_size(hosts, args))
+
+    print_table(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# circuit_breaker.py
+"""
+Per-server circuit breaker for unreachable servers.
+
+States:
+- closed:    server is polled normally
+- open:      server failed, no connection attempts until the backoff expires
+- half_open: backoff expired, the next poll is a trial connection
+
+The backoff grows exponentially with the consecutive failures and is
+jittered, so many servers going down together do not retry in lockstep.
+"""
+
+import time
+import random
+import threading
+from typing import Dict, Iterable
+
+import logging
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, *, failure_threshold: int, base_delay: float, max_delay: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.state = CLOSED
+        self.failures = 0
+        self.retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self, now: float | None = None, *, requested: bool = False) -> bool:
+        """
+        Whether a connection attempt may be made now. An explicitly `requested`
+        sync (a grant, a refresh) is let through an open circuit as a trial.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.state == OPEN:
+                if now < self.retry_at and not requested:
+                    return False
+                self.state = HALF_OPEN
+                reason = "sync requested" if now < self.retry_at else "backoff expired"
+                logger.info(f"[{self.name}] circuit half-open ({reason}), trying to reconnect")
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"[{self.name}] circuit closed, server is reachable again")
+            self.state = CLOSED
+            self.failures = 0
+            self.retry_at = 0.0
+
+    def record_failure(self, now: float | None = None) -> bool:
+        """
+        Count a failed attempt; True if it opened the closed circuit.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.failures += 1
+            if self.state == CLOSED and self.failures < self.failure_threshold:
+                return False
+
+            exponent = max(0, self.failures - self.failure_threshold)
+            delay = min(self.max_delay, self.base_delay * (2 ** exponent))
+            # "equal jitter": between half and the full backoff
+            delay = random.uniform(delay / 2, delay)
+            self.retry_at = now + delay
+            opened = self.state == CLOSED
+            if self.state != OPEN:
+                logger.info(f"[{self.name}] circuit open after {self.failures} failure(s), retry in {delay:.0f}s")
+            self.state = OPEN
+            return opened
+
+    def seconds_until_retry(self, now: float | None = None) -> float | None:
+        """
+        Remaining backoff while open, None otherwise.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.state != OPEN:
+                return None
+            return max(0.0, self.retry_at - now)
+
+    def snapshot(self) -> dict:
+        retry_in = self.seconds_until_retry()
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_in": None if retry_in is None else round(retry_in),
+        }
+
+
+class CircuitBreakerRegistry:
+    def __init__(self, *, failure_threshold: int, base_delay: float, max_delay: float):
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    name,
+                    failure_threshold=self.failure_threshold,
+                    base_delay=self.base_delay,
+                    max_delay=self.max_delay,
+                )
+                self._breakers[name] = breaker
+            return breaker
+
+    def prune(self, active_names: Iterable[str]) -> None:
+        active = set(active_names)
+        with self._lock:
+            for name in [n for n in self._breakers if n not in active]:
+                del self._breakers[name]
+
+    def snapshot(self, name: str) -> dict:
+        return self.get(name).snapshot()
+
+    def states(self) -> Dict[str, str]:
+        with self._lock:
+            return {name: breaker.state for name, breaker in self._breakers.items()}
@@ -0,0 +1,112 @@
+# ha_discovery.py
+"""
+Persistent registry of the Home Assistant discovery configs published.
+
+Maps a discovery config topic to the sha256 of its payload, the payload
+itself and the server / user it belongs to, so a restart does not republish
+every retained config, entities of deleted servers or users can be removed
+and HA can be re-announced from the registry when it comes back online.
+"""
+
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Tuple
+
+from storage import DISCOVERY_FILE
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def payload_hash(payload: str) -> str:
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class DiscoveryRegistry:
+    def __init__(self, path: Path):
+        self.path = path
+        self._entries: Dict[str, dict] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            self._entries = json.loads(self.path.read_text())
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"Discovery registry {self.path} could not be read, starting empty: {e}")
+            self._entries = {}
+
+    def is_current(self, topic: str, payload: str) -> bool:
+        """
+        True if exactly this payload was published on `topic` before.
+        """
+        with self._lock:
+            entry = self._entries.get(topic)
+        return entry is not None and entry["sha256"] == payload_hash(payload)
+
+    def put(self, topic: str, payload: str, server: str | None, user: str | None) -> None:
+        with self._lock:
+            self._entries[topic] = {
+                "sha256": payload_hash(payload),
+                "payload": payload,
+                "server": server,
+                "user": user,
+            }
+            self._dirty = True
+
+    def remove(self, topic: str, payload: str | None = None) -> None:
+        """
+        Forget `topic`; with `payload` only if that is what the registry holds for it.
+        """
+        with self._lock:
+            entry = self._entries.get(topic)
+            if entry is None or (payload is not None and entry["sha256"] != payload_hash(payload)):
+                return
+            del self._entries[topic]
+            self._dirty = True
+
+    def payloads(self) -> list[Tuple[str, str]]:
+        """
+        (topic, payload) of every registered entity, for a re-announce.
+        """
+        with self._lock:
+            return [(topic, entry["payload"]) for topic, entry in self._entries.items()]
+
+    def stale(self, servers: Dict) -> list[Tuple[str, str | None, str | None]]:
+        """
+        (topic, server, user) of entities whose server or user is no longer configured.
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+        stale = []
+        for topic, entry in entries:
+            server, user = entry.get("server"), entry.get("user")
+            config = servers.get(server)
+            if config is None or (user is not None and user not in config.get("users", {})):
+                stale.append((topic, server, user))
+        return stale
+
+    def save(self) -> None:
+        """
+        Persist the registry if it changed (called once per sync cycle).
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self._entries, indent=2, sort_keys=True)
+            self._dirty = False
+
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            tmp.write_text(data)
+            tmp.replace(self.path)
+        except OSError as e:
+            logger.warning(f"Discovery registry could not be saved: {e}")
+
+
+discovery_registry = DiscoveryRegistry(DISCOVERY_FILE)
@@ -0,0 +1,116 @@
+# hash_index.py
+"""
+Persistent content-hash index of the local cache.
+
+Maps a cached file to its sha256, keyed by path, size and mtime, so a
+cached file never has to be re-read just to compare it with a download.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict
+
+from storage import CACHE_DIR
+
+import logging
+logger = logging.getLogger(__name__)
+
+HASH_INDEX_FILE = CACHE_DIR / 'hash_index.json'
+
+
+def file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(8192), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def copy_and_hash(source, target: Path, chunk_size: int = 32768) -> str:
+    """
+    Stream a file object into target, hashing the bytes as they pass.
+    Returns the sha256 of the written content.
+    """
+    h = hashlib.sha256()
+    with open(target, "wb") as f:
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            h.update(chunk)
+            f.write(chunk)
+    return h.hexdigest()
+
+
+class HashIndex:
+    def __init__(self, path: Path):
+        self.path = path
+        self._entries: Dict[str, dict] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            self._entries = json.loads(self.path.read_text())
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"Hash index {self.path} could not be read, starting empty: {e}")
+            self._entries = {}
+
+    def get(self, local: Path) -> str | None:
+        """
+        Hash of a cached file, computed (and remembered) only if the index is stale.
+        """
+        try:
+            st = local.stat()
+        except FileNotFoundError:
+            return None
+
+        key = str(local)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            return entry["sha256"]
+
+        digest = file_hash(local)
+        self._store(key, st, digest)
+        return digest
+
+    def put(self, local: Path, digest: str) -> None:
+        """
+        Record the hash of a file that was just written (hashed while streaming).
+        """
+        self._store(str(local), local.stat(), digest)
+
+    def _store(self, key: str, st: os.stat_result, digest: str) -> None:
+        with self._lock:
+            self._entries[key] = {
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "sha256": digest,
+            }
+            self._dirty = True
+
+    def save(self) -> None:
+        """
+        Persist the index if it changed (called once per sync cycle).
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            # forget files that were removed from the cache
+            self._entries = {k: v for k, v in self._entries.items() if os.path.exists(k)}
+            data = json.dumps(self._entries)
+            self._dirty = False
+
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            tmp.write_text(data)
+            tmp.replace(self.path)
+        except OSError as e:
+            logger.warning(f"Hash index could not be saved: {e}")
+
+
+hash_index = HashIndex(HASH_INDEX_FILE)
@@ -0,0 +1,197 @@
+# intraday_history.py
+"""
+Intraday usage samples at sync-cycle resolution.
+
+Every downloaded stats file is a sample: the time timekpr wrote it
+(LAST_CHECKED) with the cumulative TIME_SPENT_DAY / PLAYTIME_SPENT_DAY of
+that moment. Samples are appended to one small binary file per user and day,
+HISTORY_DIR/<server>/<user>.intraday/YYYY-MM-DD.bin, as three little-endian
+uint32 (seconds since midnight, time spent, playtime spent), and held in
+arrays for queries.
+
+Queries (shown on the stats dashboard):
+- usage per hour of a day (differences of the cumulative values, bisect on the sorted offsets)
+- sessions: runs of samples in which the spent time grows
+"""
+
+import os
+import sys
+import struct
+import threading
+from array import array
+from bisect import bisect_right
+from datetime import date, datetime, time as dt_time, timedelta
+from pathlib import Path
+from typing import Dict, Tuple
+
+from storage import HISTORY_DIR
+
+import logging
+logger = logging.getLogger(__name__)
+
+# days of samples kept per user
+INTRADAY_DAYS = 14
+# no growth of the spent time for this long ends a session (a bit over 3 sync intervals)
+SESSION_GAP = 600
+
+_RECORD = struct.Struct("<III")
+
+
+def intraday_dir(server: str, user: str) -> Path:
+    return HISTORY_DIR / server / f"{user}.intraday"
+
+
+class DaySeries:
+    """
+    Samples of one user and day: parallel arrays, sorted by offset.
+    """
+
+    def __init__(self):
+        self.offsets = array("I")
+        self.time_spent = array("I")
+        self.playtime_spent = array("I")
+        self.size = 0  # bytes of the file these arrays were read from
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DaySeries":
+        series = cls()
+        values = array("I")
+        values.frombytes(data)
+        if sys.byteorder == "big":
+            values.byteswap()
+        series.offsets = values[0::3]
+        series.time_spent = values[1::3]
+        series.playtime_spent = values[2::3]
+        series.size = len(data)
+        return series
+
+    def append(self, offset: int, time_spent: int, playtime_spent: int) -> None:
+        self.offsets.append(offset)
+        self.time_spent.append(time_spent)
+        self.playtime_spent.append(playtime_spent)
+        self.size += _RECORD.size
+
+    def value_at(self, offset: int) -> Tuple[int, int]:
+        """
+        Cumulative (time, playtime) of the last sample at or before `offset`, 0 before the first.
+        """
+        i = bisect_right(self.offsets, offset) - 1
+        if i < 0:
+            return 0, 0
+        return self.time_spent[i], self.playtime_spent[i]
+
+
+class IntradayStore:
+    def __init__(self):
+        # (server, user, day) -> series, only ever appended to by this process
+        self._series: Dict[Tuple[str, str, str], DaySeries] = {}
+        # (server, user) -> last day the old files were pruned
+        self._pruned: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, server: str, user: str, day: str) -> Path:
+        return intraday_dir(server, user) / f"{day}.bin"
+
+    def _get(self, server: str, user: str, day: str) -> DaySeries:
+        """
+        Called with the lock held; re-read if the file is not what was loaded (restore, pruning).
+        """
+        key = (server, user, day)
+        series = self._series.get(key)
+        path = self._path(server, user, day)
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        if size % _RECORD.size:
+            # a record cut short by a crash, later appends must stay aligned
+            logger.warning(f"Dropping a partial sample at the end of {path}")
+            size -= size % _RECORD.size
+            os.truncate(path, size)
+        if series is None or series.size != size:
+            series = DaySeries.from_bytes(path.read_bytes()) if size else DaySeries()
+            self._series[key] = series
+        return series
+
+    def record(self, server: str, user: str, when: datetime, time_spent: int, playtime_spent: int) -> None:
+        """
+        Append a sample; samples not newer than the last one of the day are ignored.
+        """
+        day = when.date().isoformat()
+        offset = _seconds(when)
+        with self._lock:
+            series = self._get(server, user, day)
+            if series.offsets and offset <= series.offsets[-1]:
+                return
+            path = self._path(server, user, day)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "ab") as f:
+                f.write(_RECORD.pack(offset, max(0, time_spent), max(0, playtime_spent)))
+            series.append(offset, max(0, time_spent), max(0, playtime_spent))
+            if self._pruned.get((server, user)) != day:
+                self._prune(server, user, when.date())
+                self._pruned[(server, user)] = day
+
+    def _prune(self, server: str, user: str, today: date) -> None:
+        oldest = (today - timedelta(days=INTRADAY_DAYS - 1)).isoformat()
+        for path in intraday_dir(server, user).glob("*.bin"):
+            if path.stem < oldest:
+                path.unlink(missing_ok=True)
+                self._series.pop((server, user, path.stem), None)
+
+    def day(self, server: str, user: str, day: date) -> DaySeries:
+        with self._lock:
+            return self._get(server, user, day.isoformat())
+
+
+intraday_store = IntradayStore()
+
+
+def _seconds(moment: datetime) -> int:
+    return moment.hour * 3600 + moment.minute * 60 + moment.second
+
+
+def record_sample(server: str, user: str, when: datetime, time_spent: int, playtime_spent: int) -> None:
+    intraday_store.record(server, user, when, time_spent, playtime_spent)
+
+
+def get_hourly_usage(server: str, user: str, day: date) -> list[Tuple[int, int]]:
+    """
+    (time, playtime) used in each of the 24 hours of `day`, from the cumulative samples.
+    """
+    series = intraday_store.day(server, user, day)
+    hourly = []
+    previous = (0, 0)
+    for hour in range(24):
+        current = series.value_at(hour * 3600 + 3599)
+        hourly.append((max(0, current[0] - previous[0]), max(0, current[1] - previous[1])))
+        previous = current
+    return hourly
+
+
+def get_sessions(server: str, user: str, day: date, gap: int = SESSION_GAP) -> list[dict]:
+    """
+    Usage sessions of a day: runs of samples in which the spent time grows, split where it
+    did not grow for `gap` seconds. A session starts at the sample before its first growth.
+    """
+    series = intraday_store.day(server, user, day)
+    midnight = datetime.combine(day, dt_time())
+    sessions = []
+    current = None
+    for i in range(1, len(series.offsets)):
+        grown = series.time_spent[i] - series.time_spent[i - 1]
+        if grown <= 0:
+            continue
+        if current is None or series.offsets[i - 1] - current["end"] > gap:
+            current = {"start": series.offsets[i - 1], "end": series.offsets[i], "time_spent": 0}
+            sessions.append(current)
+        current["end"] = series.offsets[i]
+        current["time_spent"] += grown
+    return [
+        {
+            "start": midnight + timedelta(seconds=s["start"]),
+            "end": midnight + timedelta(seconds=s["end"]),
+            "time_spent": s["time_spent"],
+        }
+        for s in sessions
+    ]
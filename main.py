@@ -3,12 +3,14 @@ import os
 import json
 import mimetypes
 import nicegui
-from nicegui import ui
+from nicegui import ui, Client
 from fastapi import FastAPI, Request, Response, HTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
 
 import ui.navigation as navigation
 from ssh_sync import run_sync_loop_with_stop
+from metrics import registry
+from mqtt_client import stop_publisher
 
 import logging
 import sys
@@ -70,6 +72,8 @@ async def lifespan(app: FastAPI):
     logger.info("Stopping SSH sync worker")
     stop_event.set()
 
+    stop_publisher()
+
 
 # -------------------
 # FastAPI app (single ASGI root)
@@ -122,6 +126,18 @@ async def nicegui_static(file_path: str):
     with open(full_path, "rb") as f:
         return Response(f.read(), media_type=media_type)
 
+# -------------------
+# Prometheus metrics (behind the same ingress check as everything else)
+# -------------------
+def _active_ui_clients() -> int:
+    return sum(1 for client in Client.instances.values() if client.has_socket_connection)
+
+registry.gauge("timekpr_ui_clients", "Connected NiceGUI clients.", callback=_active_ui_clients)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # -------------------
 # Attach NiceGUI to FastAPI
 # -------------------
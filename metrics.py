@@ -0,0 +1,242 @@
+# metrics.py
+"""
+Operational metrics in the Prometheus text exposition format.
+
+Responsibilities:
+- Counters, gauges and histograms, optionally with labels
+- Gauges whose value is read at scrape time (queue depth, connected clients)
+- Render all registered metrics for the /metrics endpoint
+
+Hand-written on purpose: the format is small and the add-on should not
+pull in prometheus_client for it.
+"""
+
+import math
+import threading
+from typing import Callable, Dict, Iterable, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+# seconds, from a fast MQTT publish up to a slow sync cycle
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self) -> float:
+        """
+        Sum over all label values.
+        """
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        if not values and not self.labelnames:
+            values[()] = 0
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """
+    A set() gauge, or one read from `callback` at scrape time.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float] | None = None):
+        super().__init__(name, documentation)
+        self._value = 0.0
+        self.callback = callback
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def samples(self) -> list[str]:
+        value = self._value
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception as e:
+                logger.warning(f"Reading gauge {self.name} failed: {e}")
+                return []
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> (bucket counts, sum)
+        self._series: Dict[Tuple[str, ...], Tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._series[key] = (counts, total + value)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        lines = []
+        for key, (counts, total) in sorted(series.items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], float] | None = None) -> Gauge:
+        return self.register(Gauge(name, documentation, callback))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = MetricsRegistry()
+
+# -------------------------------------------------------------------
+# Metrics of the add-on
+# -------------------------------------------------------------------
+
+SYNC_CYCLE_SECONDS = registry.histogram(
+    "timekpr_sync_cycle_duration_seconds", "Duration of a sync cycle.",
+)
+SYNC_CYCLES = registry.counter(
+    "timekpr_sync_cycles_total", "Sync cycles run.",
+)
+SSH_CONNECT_SECONDS = registry.histogram(
+    "timekpr_ssh_connect_duration_seconds", "SSH connection setup (TCP probe, handshake, auth) per server.",
+    labelnames=("server",),
+)
+SSH_CONNECT_FAILURES = registry.counter(
+    "timekpr_ssh_connect_failures_total", "Failed SSH connection attempts per server.",
+    labelnames=("server",),
+)
+TRANSFER_BYTES = registry.counter(
+    "timekpr_sync_transferred_bytes_total", "Bytes of files transferred per server and direction.",
+    labelnames=("server", "direction"),
+)
+TRANSFER_FILES = registry.counter(
+    "timekpr_sync_transferred_files_total", "Files transferred per server and direction.",
+    labelnames=("server", "direction"),
+)
+MQTT_PUBLISH_SECONDS = registry.histogram(
+    "timekpr_mqtt_publish_duration_seconds", "Time to hand an MQTT message to the client.",
+)
+MQTT_PUBLISH_FAILURES = registry.counter(
+    "timekpr_mqtt_publish_failures_total", "MQTT publishes that failed.",
+)
+MQTT_DELIVERY_SECONDS = registry.histogram(
+    "timekpr_mqtt_delivery_duration_seconds", "Time from queueing an MQTT message to the broker's acknowledgement.",
+)
+MQTT_QUEUE_DROPPED = registry.counter(
+    "timekpr_mqtt_queue_dropped_total", "MQTT messages dropped because the publish queue was full.",
+)
+MQTT_RECONNECTS = registry.counter(
+    "timekpr_mqtt_reconnects_total", "Reconnects to the MQTT broker.",
+)
+MQTT_PUBLISH_SUPPRESSED = registry.counter(
+    "timekpr_mqtt_publish_suppressed_total", "MQTT publishes skipped because the payload was unchanged.",
+)
+HISTORY_WRITE_SECONDS = registry.histogram(
+    "timekpr_history_write_duration_seconds", "Time to update the usage history of a user.",
+)
@@ -1,9 +1,26 @@
 # mqtt_client.py
 
 import json
+import time
+import queue
 import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Tuple
+
 import paho.mqtt.client as mqtt
 from storage import ADDON_CONFIG_FILE, load_json
+from sync_trace import tracer
+from ha_discovery import discovery_registry
+from metrics import (
+    registry,
+    MQTT_PUBLISH_SECONDS,
+    MQTT_PUBLISH_FAILURES,
+    MQTT_PUBLISH_SUPPRESSED,
+    MQTT_DELIVERY_SECONDS,
+    MQTT_QUEUE_DROPPED,
+    MQTT_RECONNECTS,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -18,20 +35,44 @@ except:
     MQTT_ENABLED = False
     logger.warning("No MQTT config could be read, disabled")
 
-_client = None
+def _mqtt_option(name: str, default, cast=float):
+    try:
+        return cast(addon_options.get("mqtt", {}).get(name, default))
+    except (AttributeError, TypeError, ValueError):
+        logger.warning(f"Invalid mqtt.{name} option, falling back to {default}")
+        return default
+
+# republish an unchanged payload after this many seconds anyway (0: only on change)
+MQTT_HEARTBEAT = max(0.0, _mqtt_option("heartbeat", 0))
+
+# outgoing messages wait here while the broker is slow or unreachable
+MQTT_QUEUE_SIZE = max(1, _mqtt_option("queue_size", 1000, int))
+# what to do with a message when the queue is full: "drop_oldest", "drop_newest" or
+# "block" (the publishing thread waits up to mqtt.block_timeout, then drops the new message)
+MQTT_OVERFLOW = str(_mqtt_option("overflow", "drop_oldest", str)).lower()
+MQTT_BLOCK_TIMEOUT = max(0.0, _mqtt_option("block_timeout", 5))
+if MQTT_OVERFLOW not in ("drop_oldest", "drop_newest", "block"):
+    logger.warning(f"Invalid mqtt.overflow option '{MQTT_OVERFLOW}', falling back to drop_oldest")
+    MQTT_OVERFLOW = "drop_oldest"
+
+# accept commands (grants, sync requests) on <base_topic>/command/...; anyone who may
+# publish to the broker can then grant time, so it is off by default
+MQTT_COMMANDS = _mqtt_option("commands", False, bool)
 
-def get_client() -> mqtt.Client:
-    global _client
-    if _client:
-        return _client
+# one stats/<server> document with all users per server instead of one stats/<server>/<user> each
+MQTT_AGGREGATE = _mqtt_option("aggregate", False, bool)
 
-    client = mqtt.Client(client_id="timekpr-mngr")
-    client.connect(MQTT_HOST, MQTT_PORT, keepalive=30)
-    client.loop_start()
+# reconnect backoff, doubling from the min to the max delay
+MQTT_RECONNECT_MIN_DELAY = max(1, _mqtt_option("reconnect_min_delay", 1, int))
+MQTT_RECONNECT_MAX_DELAY = max(MQTT_RECONNECT_MIN_DELAY, _mqtt_option("reconnect_max_delay", 120, int))
 
-    _client = client
-    logger.info("MQTT connected")
-    return client
+HA_DISCOVERY_PREFIX = "homeassistant"
+# HA publishes "online" here when it (re)starts and has to learn the entities again
+HA_STATUS_TOPIC = f"{HA_DISCOVERY_PREFIX}/status"
+
+# topic -> (last payload published, monotonic time of the publish)
+_last_published: Dict[str, Tuple[str, float]] = {}
+_last_published_lock = threading.Lock()
 
 def get_device_info() -> dict:
     device = {
@@ -43,36 +84,382 @@ def get_device_info() -> dict:
     return device
 
 
-def publish(topic: str, payload: dict, *, qos: int = 1, retain: bool = False) -> None:
-    if MQTT_ENABLED:    
+# -------------------------------------------------------------------
+# Queued publisher
+# -------------------------------------------------------------------
+
+@dataclass
+class _Message:
+    topic: str
+    payload: str
+    qos: int
+    retain: bool
+    # the change-only cache key, "" for messages outside MQTT_BASE
+    key: str = ""
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+class MqttPublisher:
+    """
+    Owns the paho client and a bounded queue of outgoing messages.
+
+    Callers only enqueue; a worker thread publishes while the broker is
+    connected. paho connects in the background and reconnects with backoff;
+    after a reconnect the retained state is published again and the
+    subscriptions are renewed.
+    """
+
+    def __init__(self, host: str, port: int, maxsize: int, overflow: str):
+        self.host = host
+        self.port = port
+        self.overflow = overflow
+        self._queue: "queue.Queue[_Message]" = queue.Queue(maxsize=maxsize)
+        # topic -> last retained message, replayed after a reconnect
+        self._retained: Dict[str, _Message] = {}
+        # retained topics whose last message was dropped, replayed on the next connect
+        self._retained_dropped: set[str] = set()
+        self._retained_lock = threading.Lock()
+        # mid -> enqueue time, until the broker acknowledges the message
+        self._inflight: Dict[int, float] = {}
+        self._inflight_lock = threading.RLock()
+        # topic filter -> handler(topic, payload, retained), called on the paho network thread
+        self._subscriptions: Dict[str, Callable[[str, bytes, bool], None]] = {}
+        self._connected = threading.Event()
+        self._stop = threading.Event()
+        self._ever_connected = False
+        self._thread: threading.Thread | None = None
+        # ident of the paho network thread, set by its callbacks
+        self._network_thread: int | None = None
+
+        self.client = mqtt.Client(client_id="timekpr-mngr")
+        self.client.reconnect_delay_set(MQTT_RECONNECT_MIN_DELAY, MQTT_RECONNECT_MAX_DELAY)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+        self.client.on_message = self._on_message
+
+    def start(self) -> None:
+        self.client.connect_async(self.host, self.port, keepalive=30)
+        self.client.loop_start()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="MQTT-Publisher")
+        self._thread.start()
+        logger.info(f"MQTT publisher started for {self.host}:{self.port}")
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """
+        Give the queue `timeout` seconds to drain, then disconnect.
+        """
+        deadline = time.monotonic() + timeout
+        while self._connected.is_set() and not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        self.client.disconnect()
+        self.client.loop_stop()
+        logger.info(f"MQTT publisher stopped ({self._queue.qsize()} message(s) left in the queue)")
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def subscribe(self, topic: str, handler: Callable[[str, bytes, bool], None]) -> None:
+        """
+        Call `handler` for messages on `topic` (a filter, wildcards allowed), also after reconnects.
+        """
+        self._subscriptions[topic] = handler
+        if self._connected.is_set():
+            self.client.subscribe(topic, qos=1)
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    # ---------------- enqueue ----------------
+
+    def enqueue(self, message: _Message) -> bool:
+        """
+        Queue `message` for publishing; False if it was dropped.
+        On the paho network thread (callbacks, handlers) it never waits: with "block" a
+        full queue drops the new message at once, keepalives must not starve.
+        """
+        if message.retain:
+            with self._retained_lock:
+                self._retained[message.topic] = message
+                self._retained_dropped.discard(message.topic)
+        try:
+            if self.overflow == "block" and threading.get_ident() != self._network_thread:
+                self._queue.put(message, timeout=MQTT_BLOCK_TIMEOUT)
+            else:
+                self._queue.put_nowait(message)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow == "drop_oldest":
+            try:
+                self._dropped(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(message)
+                return True
+            except queue.Full:
+                pass
+        self._dropped(message)
+        return False
+
+    def _dropped(self, message: _Message) -> None:
+        MQTT_QUEUE_DROPPED.inc()
+        logger.warning(f"MQTT queue full ({self._queue.maxsize}), dropped message for {message.topic}")
+        if message.retain:
+            with self._retained_lock:
+                if self._retained.get(message.topic) is message:
+                    self._retained_dropped.add(message.topic)
+            if message.topic.startswith(f"{HA_DISCOVERY_PREFIX}/"):
+                discovery_registry.remove(message.topic, message.payload)
+        # it was never sent: the next identical payload must go out again
+        if message.key:
+            with _last_published_lock:
+                last = _last_published.get(message.key)
+                if last is not None and last[0] == message.payload:
+                    del _last_published[message.key]
+
+    # ---------------- worker ----------------
+
+    def _run(self) -> None:
+        pending: _Message | None = None
+        while not self._stop.is_set():
+            if not self._connected.wait(timeout=1):
+                continue
+            if pending is None:
+                try:
+                    pending = self._queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+            if self._send(pending):
+                pending = None
+
+    def _send(self, message: _Message) -> bool:
+        start = time.perf_counter()
         try:
-            client = get_client()
-            client.publish(
-                f"{MQTT_BASE}/{topic}",
-                json.dumps(payload),
-                qos=qos,
-                retain=retain,
-            )
+            with self._inflight_lock:
+                info = self.client.publish(message.topic, message.payload, qos=message.qos, retain=message.retain)
+                if info.rc == mqtt.MQTT_ERR_NO_CONN:
+                    # lost the connection in between
+                    self._connected.clear()
+                    if message.qos == 0:
+                        # paho discarded it, keep it for the reconnect
+                        return False
+                    # QoS >= 1: paho kept it and sends it after the reconnect, retrying would duplicate it
+                    info.rc = mqtt.MQTT_ERR_SUCCESS
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    raise RuntimeError(mqtt.error_string(info.rc))
+                self._inflight[info.mid] = message.enqueued
+            MQTT_PUBLISH_SECONDS.observe(time.perf_counter() - start)
         except Exception as e:
-            logger.warning(f"MQTT publish failed: {e}")
+            MQTT_PUBLISH_FAILURES.inc()
+            logger.warning(f"MQTT publish to {message.topic} failed: {e}")
+        return True
+
+    # ---------------- paho callbacks (network thread) ----------------
+
+    def _on_connect(self, client, userdata, flags, rc, *args) -> None:
+        self._network_thread = threading.get_ident()
+        if rc != 0:
+            logger.warning(f"MQTT connection refused: {mqtt.connack_string(rc)}")
+            return
+        logger.info("MQTT connected")
+        reconnect = self._ever_connected
+        if reconnect:
+            MQTT_RECONNECTS.inc()
+            # the broker (or HA) may have lost state while we were away
+            forget_published()
+        for topic in list(self._subscriptions):
+            client.subscribe(topic, qos=1)
+        self._ever_connected = True
+        # the worker drains the queue while the retained state is queued again below
+        self._connected.set()
+
+        with self._retained_lock:
+            retained = [m for t, m in self._retained.items() if reconnect or t in self._retained_dropped]
+            self._retained_dropped.clear()
+        for message in retained:
+            self.enqueue(_Message(message.topic, message.payload, message.qos, True))
+        if retained:
+            logger.info(f"MQTT connected, {len(retained)} retained message(s) queued again")
+
+    def _on_disconnect(self, client, userdata, rc, *args) -> None:
+        self._connected.clear()
+        if rc != 0:
+            logger.warning(f"MQTT connection lost ({mqtt.error_string(rc)}), reconnecting")
+
+    def _on_publish(self, client, userdata, mid, *args) -> None:
+        with self._inflight_lock:
+            enqueued = self._inflight.pop(mid, None)
+        if enqueued is not None:
+            MQTT_DELIVERY_SECONDS.observe(time.monotonic() - enqueued)
+
+    def _on_message(self, client, userdata, msg) -> None:
+        self._network_thread = threading.get_ident()
+        for topic, handler in list(self._subscriptions.items()):
+            if mqtt.topic_matches_sub(topic, msg.topic):
+                try:
+                    handler(msg.topic, msg.payload, msg.retain)
+                except Exception as e:
+                    logger.warning(f"Handling MQTT message on {msg.topic} failed: {e}")
+
+
+_publisher: MqttPublisher | None = None
+_publisher_lock = threading.Lock()
+
+def get_publisher() -> MqttPublisher:
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = MqttPublisher(MQTT_HOST, MQTT_PORT, MQTT_QUEUE_SIZE, MQTT_OVERFLOW)
+            _publisher.subscribe(HA_STATUS_TOPIC, _on_ha_status)
+            _publisher.start()
+        return _publisher
+
+
+def stop_publisher() -> None:
+    global _publisher
+    with _publisher_lock:
+        publisher, _publisher = _publisher, None
+    if publisher is not None:
+        publisher.stop()
+
+
+def _queue_depth() -> int:
+    publisher = _publisher
+    return publisher.depth() if publisher is not None else 0
+
+
+def _broker_connected() -> int:
+    publisher = _publisher
+    return int(publisher is not None and publisher.connected)
+
+
+registry.gauge("timekpr_mqtt_queue_depth", "MQTT messages waiting to be published.", callback=_queue_depth)
+registry.gauge("timekpr_mqtt_connected", "1 while the MQTT broker is connected.", callback=_broker_connected)
+
+
+# -------------------------------------------------------------------
+# Publishing
+# -------------------------------------------------------------------
+
+def _is_unchanged(topic: str, message: str) -> bool:
+    """
+    True if `message` was the last payload published on `topic` and the heartbeat is not due.
+    """
+    with _last_published_lock:
+        last = _last_published.get(topic)
+    if last is None or last[0] != message:
+        return False
+    return not MQTT_HEARTBEAT or time.monotonic() - last[1] < MQTT_HEARTBEAT
+
+
+def _remember_published(topic: str, message: str) -> None:
+    with _last_published_lock:
+        _last_published[topic] = (message, time.monotonic())
+
+
+def forget_published(prefix: str = "") -> None:
+    """
+    Drop the last-published state (of topics starting with `prefix`), so they go out again.
+    """
+    with _last_published_lock:
+        for topic in [t for t in _last_published if t.startswith(prefix)]:
+            del _last_published[topic]
+
+
+def publish(topic: str, payload: dict, *, qos: int = 1, retain: bool = False, force: bool = False) -> None:
+    """
+    Queue `payload` for `topic`, unless it is what was last published there.
+    """
+    if MQTT_ENABLED:
+        message = json.dumps(payload)
+        if not force and _is_unchanged(topic, message):
+            MQTT_PUBLISH_SUPPRESSED.inc()
+            return
+        with tracer.span("mqtt_publish"):
+            _remember_published(topic, message)
+            get_publisher().enqueue(_Message(f"{MQTT_BASE}/{topic}", message, qos, retain, key=topic))
+
+def subscribe(topic: str, handler: Callable[[str, bytes, bool], None]) -> None:
+    """
+    Call `handler(topic, payload, retained)` for every message on `topic`; both topics are
+    relative to the base topic.
+    """
+    if MQTT_ENABLED:
+        prefix = f"{MQTT_BASE}/"
+
+        def relative(full_topic: str, payload: bytes, retained: bool) -> None:
+            handler(full_topic[len(prefix):], payload, retained)
+
+        get_publisher().subscribe(prefix + topic, relative)
+
+# -------------------------------------------------------------------
+# Home Assistant discovery
+# -------------------------------------------------------------------
 
 def publish_ha_sensor(
     *,
     payload: dict,
-    platform: str
+    platform: str,
+    server: str | None = None,
+    user: str | None = None,
 ):
-    logger.info(f"HA Discovery message is to be sent for platform {platform}")
+    """
+    Publish a discovery config unless the registry shows it was already published as is.
+    `server` / `user` own the entity: it is removed when they are deleted.
+    """
     if MQTT_ENABLED:
         payload["state_topic"] = f"{MQTT_BASE}/{payload['state_topic']}"
         payload["device"] = get_device_info()
-        
-        try:
-            client = get_client()
-            client.publish(
-                f"homeassistant/{platform}/{payload['unique_id']}/config",
-                json.dumps(payload),
-                qos=1,
-                retain=True,
-            )
-        except Exception as e:
-            logger.warning(f"MQTT publish discovery data failed: {e}")
+        topic = f"{HA_DISCOVERY_PREFIX}/{platform}/{payload['unique_id']}/config"
+        message = json.dumps(payload, sort_keys=True)
+        if discovery_registry.is_current(topic, message):
+            logger.debug(f"HA Discovery config {topic} is unchanged, not sent")
+            return
+
+        logger.info(f"HA Discovery message is to be sent for platform {platform}")
+        # registered first: a message dropped from the queue takes itself out again
+        discovery_registry.put(topic, message, server, user)
+        with tracer.span("mqtt_discovery"):
+            get_publisher().enqueue(_Message(topic, message, qos=1, retain=True))
+
+
+def prune_discovery(servers: dict) -> set[Tuple[str | None, str | None]]:
+    """
+    Remove the HA entities of servers / users that are no longer configured and persist the registry.
+    Returns the (server, user) owners removed, user None for server entities.
+    """
+    removed = set()
+    if not MQTT_ENABLED:
+        return removed
+    # an unreadable servers.json must not wipe every entity
+    if servers:
+        for topic, server, user in discovery_registry.stale(servers):
+            logger.info(f"Removing HA entity {topic}, its server or user was deleted")
+            # an empty retained config deletes the entity in HA
+            get_publisher().enqueue(_Message(topic, "", qos=1, retain=True))
+            discovery_registry.remove(topic)
+            removed.add((server, user))
+    discovery_registry.save()
+    return removed
+
+
+def _on_ha_status(topic: str, payload: bytes, retained: bool) -> None:
+    """
+    HA came (back) online: announce every entity again and resend all state.
+    """
+    # a retained birth message is just the broker's memory, not a restart
+    if retained or payload.decode(errors="replace").strip() != "online":
+        return
+    entities = discovery_registry.payloads()
+    logger.info(f"Home Assistant is online, re-announcing {len(entities)} entities")
+    publisher = get_publisher()
+    for config_topic, message in entities:
+        publisher.enqueue(_Message(config_topic, message, qos=1, retain=True))
+    forget_published()
@@ -0,0 +1,165 @@
+# ssh_pool.py
+"""
+Persistent SSH connection pool.
+
+Responsibilities:
+- Keep one authenticated SSH transport and SFTP session per server
+- Share them between the upload and download phases and across cycles
+- Health-check pooled connections and reconnect transparently
+"""
+
+import time
+import socket
+import threading
+import paramiko
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator
+
+from sync_trace import tracer
+
+import logging
+logger = logging.getLogger(__name__)
+
+# paramiko sends a keepalive packet after this many idle seconds
+KEEPALIVE_SECONDS = 30
+# connections idle for longer than this get a round-trip check before reuse
+IDLE_CHECK_SECONDS = 60
+
+
+class PooledConnection:
+    def __init__(self, client: paramiko.SSHClient, sftp: paramiko.SFTPClient, signature: tuple):
+        self.client = client
+        self.sftp = sftp
+        self.signature = signature
+        self.last_used = time.monotonic()
+
+    def is_active(self) -> bool:
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def is_healthy(self) -> bool:
+        if not self.is_active():
+            return False
+        if time.monotonic() - self.last_used < IDLE_CHECK_SECONDS:
+            return True
+        # cheap round-trip on the existing SFTP session, far cheaper than a new handshake
+        try:
+            self.sftp.normalize(".")
+            return True
+        except Exception:
+            return False
+
+    def close(self) -> None:
+        for item in (self.sftp, self.client):
+            try:
+                item.close()
+            except Exception:
+                pass
+
+
+class SSHConnectionPool:
+    """
+    Long-lived SSH/SFTP connections keyed by server name.
+
+    `connect(server, server_name)` must return an authenticated SSHClient or None.
+    """
+
+    def __init__(self, connect: Callable[[Dict, str], paramiko.SSHClient | None]):
+        self._connect = connect
+        self._connections: Dict[str, PooledConnection] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(server: Dict) -> tuple:
+        return (server["host"], server.get("port", 22), server["user"], server["key"])
+
+    def _server_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def _open(self, name: str, server: Dict) -> PooledConnection | None:
+        client = self._connect(server, name)
+        if client is None:
+            return None
+
+        try:
+            client.get_transport().set_keepalive(KEEPALIVE_SECONDS)
+            with tracer.span("open_sftp"):
+                sftp = client.open_sftp()
+        except Exception as e:
+            logger.warning(f"[{name}] opening SFTP session failed: {e}")
+            client.close()
+            return None
+
+        logger.debug(f"[{name}] new pooled SSH connection")
+        return PooledConnection(client, sftp, self._signature(server))
+
+    def _get(self, name: str, server: Dict) -> PooledConnection | None:
+        with self._lock:
+            conn = self._connections.get(name)
+
+        if conn is not None:
+            if conn.signature == self._signature(server) and conn.is_healthy():
+                return conn
+            logger.info(f"[{name}] pooled SSH connection is stale, reconnecting")
+            self.discard(name)
+
+        conn = self._open(name, server)
+        if conn is not None:
+            with self._lock:
+                self._connections[name] = conn
+        return conn
+
+    @contextmanager
+    def connection(self, name: str, server: Dict) -> Iterator[PooledConnection | None]:
+        """
+        Borrow the pooled connection of a server, yields None if it is unreachable.
+        Use of one server's connection is serialized.
+        """
+        with self._server_lock(name):
+            conn = self._get(name, server)
+            if conn is None:
+                yield None
+                return
+
+            try:
+                yield conn
+            except Exception as e:
+                # transport level failures invalidate the connection, SFTP status errors do not
+                if isinstance(e, (paramiko.SSHException, EOFError, socket.timeout)) or not conn.is_active():
+                    self.discard(name)
+                raise
+            finally:
+                conn.last_used = time.monotonic()
+
+    def has_connection(self, name: str) -> bool:
+        """
+        True if the pool holds a live connection to the server.
+        """
+        with self._lock:
+            conn = self._connections.get(name)
+        return conn is not None and conn.is_active()
+
+    def discard(self, name: str) -> None:
+        with self._lock:
+            conn = self._connections.pop(name, None)
+        if conn is not None:
+            conn.close()
+
+    def prune(self, active_names: Iterable[str]) -> None:
+        """
+        Close connections of servers that are no longer configured.
+        """
+        active = set(active_names)
+        with self._lock:
+            stale = [name for name in self._connections if name not in active]
+        for name in stale:
+            logger.info(f"[{name}] server removed, closing pooled SSH connection")
+            self.discard(name)
+
+    def close_all(self) -> None:
+        with self._lock:
+            names = list(self._connections)
+        for name in names:
+            self.discard(name)
@@ -0,0 +1,455 @@
+# ssh_recorder.py
+"""
+Record and replay of SSH sessions of the sync engine.
+
+Responsibilities:
+- Record what the servers answer during sync_from_server / upload_pending:
+  remote command output and exit codes, SFTP stat results and file contents,
+  uploads and the time every operation took
+- Replay such a recording without any network, at full speed or at the
+  recorded latency, for deterministic performance regression runs
+
+The recorder wraps the connect callable of the connection pool and proxies
+the real SSHClient; the replayer's connect() stands in for ssh_sync._connect
+and returns a client answering from the recording.
+
+Recording format: one JSON line per operation in <dir>/<server>.jsonl,
+binary payloads base64 encoded; servers.json and the sync options are
+stored next to them, the replay has to run with the same ones.
+"""
+
+import io
+import json
+import time
+import base64
+import shutil
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict
+
+import paramiko
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text.encode("ascii"))
+
+
+# -------------------------------------------------------------------
+# Recording
+# -------------------------------------------------------------------
+
+class SessionRecorder:
+    """
+    Appends the operations of every recorded session to <dir>/<server>.jsonl.
+    """
+
+    def __init__(self, directory: Path, servers_file: Path | None = None, sync_options: dict | None = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if servers_file is not None and servers_file.exists():
+            shutil.copyfile(servers_file, self.directory / "servers.json")
+        if sync_options is not None:
+            (self.directory / "sync_options.json").write_text(json.dumps(sync_options, indent=2))
+        self._lock = threading.Lock()
+
+    def write(self, server_name: str, event: dict) -> None:
+        line = json.dumps(event, separators=(",", ":"))
+        with self._lock:
+            with open(self.directory / f"{server_name}.jsonl", "a") as f:
+                f.write(line + "\n")
+
+    def wrap(self, connect: Callable[[Dict, str], paramiko.SSHClient | None]) -> Callable:
+        """
+        A connect callable for SSHConnectionPool that records the sessions it opens.
+        """
+        def recording_connect(server: Dict, server_name: str):
+            start = time.perf_counter()
+            client = connect(server, server_name)
+            self.write(server_name, {
+                "op": "connect",
+                "at": time.time(),
+                "duration": time.perf_counter() - start,
+                "ok": client is not None,
+            })
+            if client is None:
+                return None
+            return _RecordingClient(self, server_name, client)
+        return recording_connect
+
+
+class _RecordingStream:
+    """
+    File-like proxy of a channel file that keeps a copy of what passed through it.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.channel = stream.channel
+        self.data = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self._stream.read(size) if size is not None and size >= 0 else self._stream.read()
+        self.data += chunk
+        return chunk
+
+    def write(self, data) -> None:
+        if isinstance(data, str):
+            data = data.encode()
+        self.data += data
+        self._stream.write(data)
+
+    def drain(self) -> None:
+        self.read()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _PendingExec:
+    def __init__(self, command: str, stdin: _RecordingStream, stdout: _RecordingStream, stderr: _RecordingStream):
+        self.command = command
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.start = time.perf_counter()
+
+
+class _RecordingClient:
+    """
+    SSHClient proxy. An exec is written once the caller moved on (next operation
+    or close), with the rest of its output drained, because callers stream or
+    skip the output as they need.
+    """
+
+    def __init__(self, recorder: SessionRecorder, server_name: str, client: paramiko.SSHClient):
+        self._recorder = recorder
+        self._server_name = server_name
+        self._client = client
+        self._pending: _PendingExec | None = None
+
+    def _record(self, event: dict) -> None:
+        event.setdefault("at", time.time())
+        self._recorder.write(self._server_name, event)
+
+    def _finish_pending(self) -> None:
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        status = None
+        try:
+            pending.stdout.drain()
+            pending.stderr.drain()
+            status = pending.stdout.channel.recv_exit_status()
+        except Exception as e:
+            logger.debug(f"[{self._server_name}] recording of '{pending.command}' incomplete: {e}")
+        self._record({
+            "op": "exec",
+            "command": pending.command,
+            "stdin": _b64(bytes(pending.stdin.data)),
+            "stdout": _b64(bytes(pending.stdout.data)),
+            "stderr": _b64(bytes(pending.stderr.data)),
+            "status": status,
+            "duration": time.perf_counter() - pending.start,
+        })
+
+    def exec_command(self, command: str, *args, **kwargs):
+        self._finish_pending()
+        stdin, stdout, stderr = self._client.exec_command(command, *args, **kwargs)
+        self._pending = _PendingExec(command, _RecordingStream(stdin), _RecordingStream(stdout), _RecordingStream(stderr))
+        return self._pending.stdin, self._pending.stdout, self._pending.stderr
+
+    def open_sftp(self):
+        self._finish_pending()
+        return _RecordingSFTP(self, self._client.open_sftp())
+
+    def close(self) -> None:
+        self._finish_pending()
+        self._record({"op": "close"})
+        self._client.close()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class _RecordingFile:
+    def __init__(self, client: _RecordingClient, path: str, handle):
+        self._client = client
+        self._path = path
+        self._handle = handle
+        self._data = bytearray()
+        self._start = time.perf_counter()
+
+    def read(self, size: int | None = None) -> bytes:
+        chunk = self._handle.read(size)
+        self._data += chunk
+        return chunk
+
+    def close(self) -> None:
+        self._handle.close()
+        self._client._record({
+            "op": "open",
+            "path": self._path,
+            "data": _b64(bytes(self._data)),
+            "duration": time.perf_counter() - self._start,
+        })
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._handle, name)
+
+
+class _RecordingSFTP:
+    def __init__(self, client: _RecordingClient, sftp: paramiko.SFTPClient):
+        self._client = client
+        self._sftp = sftp
+
+    def stat(self, path: str):
+        self._client._finish_pending()
+        start = time.perf_counter()
+        try:
+            attrs = self._sftp.stat(path)
+        except FileNotFoundError:
+            self._client._record({"op": "stat", "path": path, "missing": True,
+                                  "duration": time.perf_counter() - start})
+            raise
+        self._client._record({
+            "op": "stat",
+            "path": path,
+            "size": attrs.st_size,
+            "atime": attrs.st_atime,
+            "mtime": attrs.st_mtime,
+            "duration": time.perf_counter() - start,
+        })
+        return attrs
+
+    def open(self, path: str, mode: str = "r", *args, **kwargs):
+        self._client._finish_pending()
+        try:
+            handle = self._sftp.open(path, mode, *args, **kwargs)
+        except FileNotFoundError:
+            self._client._record({"op": "open", "path": path, "missing": True})
+            raise
+        if "r" not in mode:
+            return handle
+        return _RecordingFile(self._client, path, handle)
+
+    def put(self, localpath: str, remotepath: str, *args, **kwargs):
+        self._client._finish_pending()
+        start = time.perf_counter()
+        attrs = self._sftp.put(localpath, remotepath, *args, **kwargs)
+        self._client._record({
+            "op": "put",
+            "path": remotepath,
+            "size": Path(localpath).stat().st_size,
+            "duration": time.perf_counter() - start,
+        })
+        return attrs
+
+    def __getattr__(self, name):
+        return getattr(self._sftp, name)
+
+
+# -------------------------------------------------------------------
+# Replay
+# -------------------------------------------------------------------
+
+class _ReplayChannel:
+    def __init__(self, status: int | None):
+        self.status_event = threading.Event()
+        self.status_event.set()
+        self._status = -1 if status is None else status
+
+    def recv_exit_status(self) -> int:
+        return self._status
+
+    def shutdown_write(self) -> None:
+        pass
+
+    def settimeout(self, timeout) -> None:
+        pass
+
+
+class _ReplayStream(io.BytesIO):
+    def __init__(self, data: bytes = b"", channel: _ReplayChannel | None = None):
+        super().__init__(data)
+        self.channel = channel
+
+    def prefetch(self, *args) -> None:
+        pass
+
+
+class _ReplayTransport:
+    def __init__(self):
+        self.active = True
+
+    def is_active(self) -> bool:
+        return self.active
+
+    def set_keepalive(self, interval) -> None:
+        pass
+
+
+class SessionReplayer:
+    """
+    Answers the operations of the sync engine from a recording.
+
+    Answers are matched per server by operation and command / path, in recorded
+    order; once the recorded answers of a key are used up the last one is
+    repeated. Operations that were never recorded are counted in `unmatched`.
+    latency_scale 0 replays at full speed, 1 at the recorded latency.
+    """
+
+    def __init__(self, directory: Path, latency_scale: float = 0.0):
+        self.directory = Path(directory)
+        self.latency_scale = latency_scale
+        self.unmatched: Dict[str, int] = {}
+        self._answers: Dict[str, Dict[tuple, deque]] = {}
+        self._last: Dict[str, Dict[tuple, dict]] = {}
+        self._connects: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+        for path in sorted(self.directory.glob("*.jsonl")):
+            server_name = path.stem
+            answers: Dict[tuple, deque] = {}
+            connects: deque = deque()
+            with open(path) as f:
+                for line in f:
+                    event = json.loads(line)
+                    key = self._key(event)
+                    if event["op"] == "connect":
+                        connects.append(event)
+                    elif key is not None:
+                        answers.setdefault(key, deque()).append(event)
+            self._answers[server_name] = answers
+            self._last[server_name] = {}
+            self._connects[server_name] = connects
+
+    @staticmethod
+    def _key(event: dict) -> tuple | None:
+        if event["op"] == "exec":
+            return ("exec", event["command"])
+        if event["op"] in ("open", "stat", "put"):
+            return (event["op"], event["path"])
+        return None
+
+    def probe_count(self, server_name: str) -> int:
+        """
+        Recorded metadata probes of a server, i.e. the number of recorded cycles it was online.
+        """
+        return sum(
+            len(events) for key, events in self._answers.get(server_name, {}).items()
+            if key[0] == "exec" and key[1].startswith("stat -c")
+        )
+
+    def servers(self) -> list[str]:
+        return list(self._answers)
+
+    def _wait(self, event: dict) -> None:
+        if self.latency_scale and event.get("duration"):
+            time.sleep(event["duration"] * self.latency_scale)
+
+    def answer(self, server_name: str, key: tuple) -> dict | None:
+        with self._lock:
+            queue = self._answers.get(server_name, {}).get(key)
+            if queue:
+                event = queue.popleft()
+                self._last[server_name][key] = event
+            else:
+                event = self._last.get(server_name, {}).get(key)
+            if event is None:
+                name = f"{server_name}: {key[0]} {key[1]}"
+                self.unmatched[name] = self.unmatched.get(name, 0) + 1
+        if event is not None:
+            self._wait(event)
+        return event
+
+    def connect(self, server: Dict, server_name: str):
+        """
+        Connect callable for SSHConnectionPool.
+        """
+        with self._lock:
+            connects = self._connects.get(server_name)
+            event = connects.popleft() if connects else {"ok": server_name in self._answers, "duration": 0}
+        self._wait(event)
+        if not event.get("ok"):
+            return None
+        return _ReplayClient(self, server_name)
+
+
+class _ReplayClient:
+    def __init__(self, replayer: SessionReplayer, server_name: str):
+        self._replayer = replayer
+        self._server_name = server_name
+        self._transport = _ReplayTransport()
+
+    def get_transport(self) -> _ReplayTransport:
+        return self._transport
+
+    def exec_command(self, command: str, *args, **kwargs):
+        event = self._replayer.answer(self._server_name, ("exec", command))
+        if event is None:
+            # like a shell: command not found
+            channel = _ReplayChannel(127)
+            return _ReplayStream(channel=channel), _ReplayStream(channel=channel), _ReplayStream(channel=channel)
+        channel = _ReplayChannel(event.get("status"))
+        return (
+            _ReplayStream(channel=channel),
+            _ReplayStream(_unb64(event["stdout"]), channel),
+            _ReplayStream(_unb64(event["stderr"]), channel),
+        )
+
+    def open_sftp(self):
+        return _ReplaySFTP(self._replayer, self._server_name)
+
+    def close(self) -> None:
+        self._transport.active = False
+
+
+class _ReplaySFTP:
+    def __init__(self, replayer: SessionReplayer, server_name: str):
+        self._replayer = replayer
+        self._server_name = server_name
+        self._channel = _ReplayChannel(0)
+
+    def get_channel(self) -> _ReplayChannel:
+        return self._channel
+
+    def normalize(self, path: str) -> str:
+        return path
+
+    def stat(self, path: str) -> paramiko.SFTPAttributes:
+        event = self._replayer.answer(self._server_name, ("stat", path))
+        if event is None or event.get("missing"):
+            raise FileNotFoundError(path)
+        attrs = paramiko.SFTPAttributes()
+        attrs.st_size = event["size"]
+        attrs.st_atime = event["atime"]
+        attrs.st_mtime = event["mtime"]
+        return attrs
+
+    def open(self, path: str, mode: str = "r", *args, **kwargs):
+        if "r" not in mode:
+            return _ReplayStream()
+        event = self._replayer.answer(self._server_name, ("open", path))
+        if event is None or event.get("missing"):
+            raise FileNotFoundError(path)
+        return _ReplayStream(_unb64(event["data"]))
+
+    def put(self, localpath: str, remotepath: str, *args, **kwargs):
+        self._replayer.answer(self._server_name, ("put", remotepath))
+
+    def close(self) -> None:
+        pass
@@ -10,22 +10,46 @@ Responsibilities:
 """
 
 import os
+import json
+import math
 import time
+import shlex
 import socket
-import hashlib
+import tarfile
 import paramiko
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 
 from stats_history import update_daily_usage
-from mqtt_client import publish, publish_ha_sensor
+from intraday_history import record_sample
+from hash_index import hash_index, copy_and_hash
+from stats_cache import stats_cache
+from mqtt_client import publish, publish_ha_sensor, prune_discovery, subscribe, MQTT_COMMANDS, MQTT_AGGREGATE
+from sync_trace import tracer, CYCLE_PHASE
+from metrics import (
+    registry,
+    SYNC_CYCLE_SECONDS,
+    SYNC_CYCLES,
+    SSH_CONNECT_SECONDS,
+    SSH_CONNECT_FAILURES,
+    TRANSFER_BYTES,
+    TRANSFER_FILES,
+    HISTORY_WRITE_SECONDS,
+)
 
 
 from servers import load_servers, get_remote_paths
+from ssh_pool import SSHConnectionPool
+from ssh_recorder import SessionRecorder
+from sync_scheduler import PollScheduler
+from circuit_breaker import CircuitBreakerRegistry, CLOSED
 from storage import (
     KEYS_DIR,
     PENDING_DIR,
+    SERVERS_FILE,
     server_cache_dir,
     user_cache_dir,
     stats_cache_dir,
@@ -33,6 +57,7 @@ from storage import (
     pending_user_dir,
     pending_stats_dir,
     create_backup,
+    get_addon_section,
 )
 
 import threading
@@ -41,6 +66,64 @@ trigger_event = threading.Event()
 import logging
 logger = logging.getLogger(__name__)
 
+# -------------------------------------------------------------------
+# Sync options (add-on config, "sync" section)
+# -------------------------------------------------------------------
+sync_options = get_addon_section("sync")
+
+try:
+    SYNC_MAX_WORKERS = max(1, int(sync_options.get("max_workers", 8)))
+except (TypeError, ValueError):
+    SYNC_MAX_WORKERS = 8
+    logger.warning("Invalid sync.max_workers option, falling back to 8")
+
+# also hash remote files in the metadata probe, so a touched but identical file is not downloaded
+SYNC_PROBE_HASH = bool(sync_options.get("probe_hash", False))
+
+# pull several changed files of a server as one tar stream instead of one sftp.get each
+SYNC_BUNDLE = bool(sync_options.get("bundle", True))
+
+# record every SSH session to this directory, for offline replay (bench/replay_sessions.py)
+SYNC_RECORD_DIR = sync_options.get("record_dir") or None
+
+def _seconds_option(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(sync_options.get(name, default)))
+    except (TypeError, ValueError):
+        logger.warning(f"Invalid sync.{name} option, falling back to {default}")
+        return default
+
+# quiet period that coalesces bursts of manual triggers into one targeted sync
+SYNC_TRIGGER_DEBOUNCE = _seconds_option("trigger_debounce", 0.5)
+
+# adaptive polling: the normal interval is the sync loop interval (180 s)
+SYNC_ACTIVE_INTERVAL = _seconds_option("active_interval", 60)
+SYNC_IDLE_INTERVAL = _seconds_option("idle_interval", 600)
+SYNC_OFFLINE_INTERVAL = _seconds_option("offline_interval", 600)
+# a server without user activity for this long counts as idle
+SYNC_IDLE_AFTER = _seconds_option("idle_after", 1800)
+# LAST_CHECKED must be this recent for a growing TIME_SPENT_DAY to count as activity
+SYNC_ACTIVITY_FRESHNESS = _seconds_option("activity_freshness", 600)
+
+# circuit breaker for unreachable servers, the backoff doubles up to the offline interval
+try:
+    SYNC_BREAKER_THRESHOLD = max(1, int(sync_options.get("breaker_threshold", 2)))
+except (TypeError, ValueError):
+    SYNC_BREAKER_THRESHOLD = 2
+    logger.warning("Invalid sync.breaker_threshold option, falling back to 2")
+SYNC_BREAKER_BASE_DELAY = _seconds_option("breaker_base_delay", 60)
+# quick TCP connect check before the (5 s timeout) SSH handshake
+SYNC_TCP_PROBE_TIMEOUT = _seconds_option("tcp_probe_timeout", 1.5)
+
+# deadlines: per phase (connect incl. auth, metadata probe, download, upload, remote
+# commands) and for a whole cycle, after which the servers still running are abandoned
+SYNC_CONNECT_TIMEOUT = _seconds_option("connect_timeout", 5)
+SYNC_PROBE_TIMEOUT = _seconds_option("probe_timeout", 10)
+SYNC_DOWNLOAD_TIMEOUT = _seconds_option("download_timeout", 30)
+SYNC_UPLOAD_TIMEOUT = _seconds_option("upload_timeout", 30)
+SYNC_EXEC_TIMEOUT = _seconds_option("exec_timeout", 30)
+SYNC_CYCLE_TIMEOUT = _seconds_option("cycle_timeout", 120)
+
 
 # only allow modern ciphers (AES and CHACHA20)
 paramiko.Transport._preferred_ciphers = (
@@ -55,12 +138,15 @@ class Heartbeat:
     def __init__(self, timeout: float):
         self._last_seen = 0.0
         self.timeout = timeout
+        self.last_duration: float | None = None
 
     def set_timeout(self, timeout: float):
         self.timeout = timeout
 
-    def beat(self):
+    def beat(self, duration: float | None = None):
         self._last_seen = time.time()
+        if duration is not None:
+            self.last_duration = duration
 
     def is_alive(self) -> bool:
         return (time.time() - self._last_seen) < self.timeout
@@ -119,12 +205,47 @@ change_upload_is_pending = VariableWatcher()
 servers_online = ServersWatcher()
 server_user_list = list()
 server_list = list()
+# guards server_list / server_user_list, servers are synced from worker threads
+_registration_lock = threading.Lock()
+
+poll_scheduler = PollScheduler(
+    active_interval=SYNC_ACTIVE_INTERVAL,
+    normal_interval=180,
+    idle_interval=SYNC_IDLE_INTERVAL,
+    offline_interval=SYNC_OFFLINE_INTERVAL,
+    idle_after=SYNC_IDLE_AFTER,
+)
+circuit_breakers = CircuitBreakerRegistry(
+    failure_threshold=SYNC_BREAKER_THRESHOLD,
+    base_delay=SYNC_BREAKER_BASE_DELAY,
+    max_delay=SYNC_OFFLINE_INTERVAL,
+)
+# "server/user" -> TIME_SPENT_DAY of the previous sample
+_last_time_spent: Dict[str, int] = {}
+# servers with a user actively spending time since their last poll
+_active_servers: set[str] = set()
+_activity_lock = threading.Lock()
 
 
 # -------------------------------------------------------------------
 # Helpers
 # -------------------------------------------------------------------
 
+class SyncTimeout(TimeoutError):
+    """
+    A sync phase overran its deadline. Being a socket.timeout, the connection
+    pool drops the connection it happened on.
+    """
+
+
+def _wait_exit_status(channel, phase: str, timeout: float) -> int:
+    """
+    recv_exit_status() with a deadline.
+    """
+    if not channel.status_event.wait(timeout):
+        raise SyncTimeout(f"{phase} timed out after {timeout:.0f}s")
+    return channel.recv_exit_status()
+
 def _tree_has_any_file(directory):
     found = False
     for _, _, files in os.walk(directory):
@@ -133,16 +254,23 @@ def _tree_has_any_file(directory):
     logger.info(f"Finding files in folder: {directory} with result: {found}")
     return found
 
-def _file_hash(path: Path) -> str:
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
-    return h.hexdigest()
+def _tcp_probe(host: str, port: int) -> bool:
+    """
+    Cheap reachability check: a plain TCP connect to the SSH port.
+    """
+    try:
+        with socket.create_connection((host, port), timeout=SYNC_TCP_PROBE_TIMEOUT):
+            return True
+    except OSError:
+        return False
 
 
 def _connect(server: Dict, servername: str) -> paramiko.SSHClient | None:
     global servers_online
+    if not _tcp_probe(server["host"], server.get("port", 22)):
+        logger.debug(f"TCP probe to {server['host']} failed, skipping SSH handshake")
+        return None
+
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
@@ -152,7 +280,9 @@ def _connect(server: Dict, servername: str) -> paramiko.SSHClient | None:
             port=server.get("port", 22),
             username=server["user"],
             key_filename=str(KEYS_DIR / server["key"]),
-            timeout=5,
+            timeout=SYNC_CONNECT_TIMEOUT,
+            banner_timeout=SYNC_CONNECT_TIMEOUT,
+            auth_timeout=SYNC_CONNECT_TIMEOUT,
         )
         return client
 
@@ -169,55 +299,298 @@ def _connect(server: Dict, servername: str) -> paramiko.SSHClient | None:
 
 
 
-def _scp_get_if_changed(sftp, remote: str, local: Path) -> bool:
+def _traced_connect(server: Dict, servername: str) -> paramiko.SSHClient | None:
+    start = time.perf_counter()
+    client = _connect(server, servername)
+    duration = time.perf_counter() - start
+    tracer.record("connect", duration, ok=client is not None)
+    if client is None:
+        SSH_CONNECT_FAILURES.inc(server=servername)
+    else:
+        SSH_CONNECT_SECONDS.observe(duration, server=servername)
+    return client
+
+
+# one authenticated transport + SFTP session per server, reused across phases and cycles
+if SYNC_RECORD_DIR:
+    logger.warning(f"SSH sessions are recorded to {SYNC_RECORD_DIR}")
+    recorder = SessionRecorder(Path(SYNC_RECORD_DIR), SERVERS_FILE, sync_options)
+    ssh_pool = SSHConnectionPool(connect=recorder.wrap(_traced_connect))
+else:
+    ssh_pool = SSHConnectionPool(connect=_traced_connect)
+
+
+@dataclass
+class RemoteStat:
+    st_size: int
+    st_atime: float
+    st_mtime: float
+    sha256: str | None = None
+
+
+PROBE_HASH_MARKER = "__TIMEKPR_MNGR_HASH__"
+PROBE_END_MARKER = "__TIMEKPR_MNGR_END__"
+
+
+def _probe_remote_files(client, remotes: list[str], with_hash: bool = False) -> Dict[str, RemoteStat] | None:
     """
-    Download remote file only if changed.
-    Returns True if local file was updated.
+    Collect size / atime / mtime (and optionally sha256) of all remote files
+    with a single remote command instead of one sftp.stat per file.
+    Missing files are left out of the result.
+    Returns None if the probe could not run, callers then fall back to sftp.stat.
     """
+    if not remotes:
+        return {}
+
+    quoted = " ".join(shlex.quote(remote) for remote in remotes)
+    command = f"stat -c '%s %X %Y %n' -- {quoted} 2>/dev/null"
+    if with_hash:
+        command += f"; echo {PROBE_HASH_MARKER}; sha256sum -- {quoted} 2>/dev/null"
+    command += f"; echo {PROBE_END_MARKER}"
+
     try:
-        remote_stat = sftp.stat(remote)
-    except FileNotFoundError:
+        stdin, stdout, stderr = client.exec_command(command, timeout=SYNC_PROBE_TIMEOUT)
+        output = stdout.read().decode(errors="replace")
+    except socket.timeout as e:
+        raise SyncTimeout(f"metadata probe timed out after {SYNC_PROBE_TIMEOUT:.0f}s") from e
+    except Exception as e:
+        logger.warning(f"Remote metadata probe failed: {e}")
+        return None
+
+    if PROBE_END_MARKER not in output:
+        logger.warning("Remote metadata probe returned incomplete output")
+        return None
+
+    wanted = set(remotes)
+    result: Dict[str, RemoteStat] = {}
+    hashes: Dict[str, str] = {}
+    in_hash_section = False
+    for line in output.splitlines():
+        if line == PROBE_HASH_MARKER:
+            in_hash_section = True
+            continue
+        if line == PROBE_END_MARKER:
+            break
+        if in_hash_section:
+            # sha256sum format: "<64 hex digits>  <path>"
+            digest, name = line[:64], line[66:]
+            if name in wanted:
+                hashes[name] = digest
+            continue
+        parts = line.split(" ", 3)
+        if len(parts) != 4 or parts[3] not in wanted:
+            continue
+        try:
+            result[parts[3]] = RemoteStat(
+                st_size=int(parts[0]),
+                st_atime=float(parts[1]),
+                st_mtime=float(parts[2]),
+            )
+        except ValueError:
+            continue
+
+    for name, digest in hashes.items():
+        if name in result:
+            result[name].sha256 = digest
+    return result
+
+
+def _is_unchanged(local: Path, remote_stat) -> bool:
+    """
+    True if the cached copy matches the remote file metadata (or content hash).
+    """
+    if not local.exists():
         return False
 
-    local.parent.mkdir(parents=True, exist_ok=True)
+    local_stat = local.stat()
+
+    # Fast path: same size and timestamp
+    if (
+        local_stat.st_size == remote_stat.st_size
+        and int(local_stat.st_mtime) == int(remote_stat.st_mtime)
+    ):
+        return True
+
+    # touched but identical content: adopt the remote timestamp, skip the download
+    remote_hash = getattr(remote_stat, "sha256", None)
+    if remote_hash and local_stat.st_size == remote_stat.st_size and hash_index.get(local) == remote_hash:
+        os.utime(local, (remote_stat.st_atime, remote_stat.st_mtime))
+        # the index entry is keyed on the old mtime, re-key it so the next lookup needs no rehash
+        hash_index.put(local, remote_hash)
+        return True
+
+    return False
 
-    if local.exists():
-        local_stat = local.stat()
 
-        # Fast path: same size and timestamp
-        if (
-            local_stat.st_size == remote_stat.st_size
-            and int(local_stat.st_mtime) == int(remote_stat.st_mtime)
-        ):
+def _scp_get_if_changed(sftp, remote: str, local: Path, remote_stat=None) -> bool:
+    """
+    Download remote file only if changed.
+    remote_stat can be passed in from _probe_remote_files to skip the sftp.stat round-trip.
+    Returns True if local file was updated.
+    """
+    if remote_stat is None:
+        try:
+            remote_stat = sftp.stat(remote)
+        except FileNotFoundError:
             return False
 
+    local.parent.mkdir(parents=True, exist_ok=True)
+
+    if _is_unchanged(local, remote_stat):
+        return False
+
     tmp = local.with_suffix(local.suffix + ".tmp")
 
     try:
-        sftp.get(remote, str(tmp))
+        with sftp.open(remote, "rb") as source:
+            source.prefetch(remote_stat.st_size)
+            digest = copy_and_hash(source, tmp)
+    except socket.timeout as e:
+        tmp.unlink(missing_ok=True)
+        raise SyncTimeout(f"download of {remote} timed out") from e
     except Exception as e:
         logger.warning(f"Failed to download {remote}: {e}")
+        tmp.unlink(missing_ok=True)
         return False
 
     if local.exists():
-        if _file_hash(tmp) == _file_hash(local):
+        if hash_index.get(local) == digest:
             tmp.unlink()
             return False
 
     tmp.replace(local)
     os.utime(local, (remote_stat.st_atime, remote_stat.st_mtime))
+    hash_index.put(local, digest)
+    stats_cache.invalidate(local)
     return True
 
 
+def _bundle_get(client, files: list[tuple[str, Path, RemoteStat]]) -> set[Path] | None:
+    """
+    Download several changed files in a single tar stream over one exec channel.
+    All files are staged next to their cache location first and only moved in
+    place once the whole stream arrived, so a broken transfer changes nothing.
+    Returns the updated local paths, or None if the bundle transfer failed.
+    """
+    members = {remote.lstrip("/"): (remote, local, remote_stat) for remote, local, remote_stat in files}
+    command = "tar -C / -cf - -- " + " ".join(shlex.quote(name) for name in members)
+
+    staged: Dict[str, Path] = {}
+    digests: Dict[str, str] = {}
+
+    def discard_staged():
+        for tmp in staged.values():
+            tmp.unlink(missing_ok=True)
+
+    try:
+        stdin, stdout, stderr = client.exec_command(command, timeout=SYNC_DOWNLOAD_TIMEOUT)
+        with tarfile.open(fileobj=stdout, mode="r|") as tar:
+            for member in tar:
+                if not member.isfile() or member.name not in members or member.name in staged:
+                    continue
+                remote, local, remote_stat = members[member.name]
+                local.parent.mkdir(parents=True, exist_ok=True)
+                tmp = local.with_suffix(local.suffix + ".tmp")
+                staged[member.name] = tmp
+                digests[member.name] = copy_and_hash(tar.extractfile(member), tmp)
+        exit_status = _wait_exit_status(stdout.channel, "bundle download", SYNC_DOWNLOAD_TIMEOUT)
+    except socket.timeout as e:
+        discard_staged()
+        raise SyncTimeout(f"bundle download timed out after {SYNC_DOWNLOAD_TIMEOUT:.0f}s") from e
+    except Exception as e:
+        logger.warning(f"Bundle download failed: {e}")
+        discard_staged()
+        return None
+
+    if exit_status != 0 or len(staged) != len(members):
+        logger.warning(
+            f"Bundle download incomplete (exit code {exit_status}, "
+            f"{len(staged)}/{len(members)} files), falling back to single downloads"
+        )
+        discard_staged()
+        return None
+
+    updated = set()
+    for name, tmp in staged.items():
+        remote, local, remote_stat = members[name]
+        if local.exists() and hash_index.get(local) == digests[name]:
+            tmp.unlink()
+            continue
+        tmp.replace(local)
+        os.utime(local, (remote_stat.st_atime, remote_stat.st_mtime))
+        hash_index.put(local, digests[name])
+        stats_cache.invalidate(local)
+        updated.add(local)
+    return updated
+
+
+def _download_changed(client, sftp, files: list[tuple[str, Path]], probe: Dict[str, RemoteStat] | None) -> set[Path]:
+    """
+    Bring the local cache of the given (remote, local) files up to date.
+    Returns the local paths that were updated.
+    """
+    if probe is None:
+        updated = set()
+        for remote, local in files:
+            with tracer.span("download"):
+                if _scp_get_if_changed(sftp, remote, local):
+                    updated.add(local)
+        return updated
+
+    changed = [
+        (remote, local, probe[remote])
+        for remote, local in files
+        if remote in probe and not _is_unchanged(local, probe[remote])
+    ]
+
+    updated = set()
+    if SYNC_BUNDLE:
+        # tar is run relative to /, so only absolute (and distinct) paths can be bundled
+        bundle = []
+        for item in changed:
+            if item[0].startswith("/") and item[0] not in {b[0] for b in bundle}:
+                bundle.append(item)
+        if len(bundle) > 1:
+            with tracer.span("bundle"):
+                bundled = _bundle_get(client, bundle)
+            if bundled is not None:
+                updated |= bundled
+                changed = [item for item in changed if item not in bundle]
+
+    for remote, local, remote_stat in changed:
+        with tracer.span("download"):
+            if _scp_get_if_changed(sftp, remote, local, remote_stat):
+                updated.add(local)
+    return updated
+
+
 def _scp_put(sftp, local: Path, remote: str) -> bool:
     result = False
     try:
-        sftp.put(str(local), remote)
+        with tracer.span("upload"):
+            sftp.put(str(local), remote)
         result = True
+    except socket.timeout as e:
+        raise SyncTimeout(f"upload of {remote} timed out") from e
     except:
         result = False
     return result
 
+def _count_transfer(server_name: str, direction: str, local: Path) -> None:
+    TRANSFER_FILES.inc(server=server_name, direction=direction)
+    TRANSFER_BYTES.inc(local.stat().st_size, server=server_name, direction=direction)
+
+
+def _pending_upload_count() -> int:
+    return sum(1 for path in PENDING_DIR.rglob("*") if path.is_file())
+
+
+registry.gauge(
+    "timekpr_pending_uploads", "Local changes waiting to be uploaded.",
+    callback=_pending_upload_count,
+)
+
+
 def _trigger_user_file_renewal_over_ssh(client, a_username) -> bool:
     result = True
     try:
@@ -225,10 +598,12 @@ def _trigger_user_file_renewal_over_ssh(client, a_username) -> bool:
 
         #This extra command is required to update the server side file to the Today's one
         command = f'timekpra --getuserinfo {a_username}'
-        stdin, stdout, stderr = client.exec_command(command)
-        if (stdout.channel.recv_exit_status() == 0):
+        stdin, stdout, stderr = client.exec_command(command, timeout=SYNC_EXEC_TIMEOUT)
+        if (_wait_exit_status(stdout.channel, command, SYNC_EXEC_TIMEOUT) == 0):
             logger.debug(f"ssh command to trigger user stats file renew returned with 0 exit code")
             result = (result and True)
+    except socket.timeout:
+        raise
     except:
         logger.warning("ssh command to trigger user stats file renew execution failed, caught by exception handler")
         result = False
@@ -240,47 +615,93 @@ def _is_file_modified_today(path: Path) -> bool:
     return mtime.date() == date.today()
 
 
-def _ssh_update_allowance(a_client, local: Path, a_username) -> bool:
-    result = True
+RC_MARKER = "__TIMEKPR_MNGR_RC__"
 
+
+def _run_remote_batch(a_client, commands: list[str]) -> list[int | None]:
+    """
+    Run several commands in a single remote shell (one exec channel, one round-trip).
+    Returns the exit status of every command, None if a command did not report one.
+    """
+    script = "".join(
+        f"{command} </dev/null\nprintf '\\n{RC_MARKER} {i} %d\\n' $?\n"
+        for i, command in enumerate(commands)
+    )
     try:
-        #sftp.put(str(local), remote)
-        logger.debug("ssh command execution started")
+        stdin, stdout, stderr = a_client.exec_command("sh -s", timeout=SYNC_EXEC_TIMEOUT)
+        stdin.write(script)
+        stdin.channel.shutdown_write()
+        output = stdout.read().decode(errors="replace")
+    except socket.timeout as e:
+        raise SyncTimeout(f"remote command batch timed out after {SYNC_EXEC_TIMEOUT:.0f}s") from e
+
+    statuses: list[int | None] = [None] * len(commands)
+    for line in output.splitlines():
+        if not line.startswith(RC_MARKER):
+            continue
+        try:
+            _, index, status = line.split()
+            statuses[int(index)] = int(status)
+        except (ValueError, IndexError):
+            continue
+    return statuses
+
+
+def _ssh_update_allowances(a_client, files: Dict[Path, str]) -> Dict[Path, bool]:
+    """
+    Apply the pending allowance (.stats) files of a server, path -> content, in one remote script.
+    Returns per file whether all of its commands succeeded; a file with a malformed line fails as a whole.
+    """
+    commands: list[str] = []
+    owners: list[Path] = []
+    rejected: set[Path] = set()
 
+    for local in files:
+        a_username = local.stem
         #This extra command is required to update the server side file to the Today's one
-        command = f'timekpra --getuserinfo {a_username}'
-        stdin, stdout, stderr = a_client.exec_command(command)
-        if (stdout.channel.recv_exit_status() == 0):
-            logger.debug(f"ssh command returned with 0 exit code")
-            result = (result and True)
-        else:
-            logger.warning(f"ssh command '{command}' returned with non-zero exit code")
-            result = False
-        time.sleep(0.5)
+        commands.append(f"timekpra --getuserinfo {shlex.quote(a_username)} >/dev/null")
+        owners.append(local)
 
         # Guard: only run if file is from today - extra time is granted (for) today
         if not _is_file_modified_today(local):
             logger.warning(
                 f"Skipping allowance update for {a_username}, it is not granted today. (Extra time is only allowed to grant for the day it is provided, if not used, it is lost) "
             )
-        else:        
-            text = local.read_text()
-            logger.debug("ssh command execution started, file is read")
-            for raw in text.splitlines():
-                command = raw
-                logger.debug(f"ssh command identified:  {command}")
-                stdin, stdout, stderr = a_client.exec_command(command)
-                logger.debug(f"ssh command returned")
-                if (stdout.channel.recv_exit_status() == 0):
-                    logger.info(f"ssh command returned with 0 exit code")
-                    result = (result and True)
-                else:
-                    logger.warning(f"ssh command returned with non-zero exit code")
-                    result = False
-    except:
-        logger.warning("ssh command execution failed, caught by exception handler")
-        result = False
-    return result
+            continue
+
+        # re-quoted, so one malformed line cannot break the shared script
+        file_commands = []
+        try:
+            for raw in files[local].splitlines():
+                if raw.strip():
+                    file_commands.append(shlex.join(shlex.split(raw)))
+        except ValueError as e:
+            # none of the file is applied: it stays pending (shown as such) until it is fixed
+            # or replaced by a new grant, instead of being removed as if it had been applied
+            logger.error(f"Not applying {local}, malformed line {raw!r} ({e})")
+            rejected.add(local)
+            continue
+        for command in file_commands:
+            logger.debug(f"ssh command identified:  {command}")
+            commands.append(command)
+            owners.append(local)
+
+    results = {local: local not in rejected for local in files}
+    try:
+        statuses = _run_remote_batch(a_client, commands)
+    except SyncTimeout:
+        raise
+    except Exception as e:
+        logger.warning(f"ssh command batch execution failed: {e}")
+        return {local: False for local in files}
+
+    for command, local, status in zip(commands, owners, statuses):
+        if status == 0:
+            logger.debug(f"ssh command '{command}' returned with 0 exit code")
+        else:
+            logger.warning(f"ssh command '{command}' returned with exit code {status}")
+            results[local] = False
+    return results
 
 def register_server_sensors(server: str):
     publish_ha_sensor(
@@ -295,50 +716,111 @@ def register_server_sensors(server: str):
             "qos": 1,
         },
         platform = "binary_sensor",
+        server = server,
+    )
+
+    publish_ha_sensor(
+        payload = {
+            "name": f"Timekpr Server {server} connection",
+            "value_template": f"{{{{ value_json.circuit['{server}'] | default('closed') }}}}",
+            "unique_id": f"timekpr_{server}_circuit",
+            "state_topic": f"servers/online",
+            "icon": "mdi:lan-pending",
+            "qos": 1,
+        },
+        platform = "sensor",
+        server = server,
     )
 
+def _user_stats_source(server: str, user: str, field: str) -> tuple[str, str]:
+    """
+    State topic and value template of a user sensor, per user or from the server document.
+    """
+    if MQTT_AGGREGATE:
+        return (
+            f"stats/{server}",
+            f"{{{{ value_json.users['{user}'].{field} if '{user}' in value_json.users else none }}}}",
+        )
+    return f"stats/{server}/{user}", f"{{{{ value_json.{field} }}}}"
+
+
 def register_user_sensors(server: str, user: str):
+    state_topic, value_template = _user_stats_source(server, user, "time_spent_day")
     publish_ha_sensor(
         payload = {
             "name": f"{server} {user} Time Used Today",
-            "state_topic": f"stats/{server}/{user}",
-            "value_template": "{{ value_json.time_spent_day }}",
+            "state_topic": state_topic,
+            "value_template": value_template,
             "unit_of_measurement": "s",
             "state_class": "measurement",
             "device_class": "duration",
             "unique_id": f"timekpr_{server}_{user}_time",
         },
         platform = "sensor",
+        server = server,
+        user = user,
     )
 
+    state_topic, value_template = _user_stats_source(server, user, "playtime_spent_day")
     publish_ha_sensor(
         payload = {
             "name": f"{server} {user} Playtime Today",
-            "state_topic": f"stats/{server}/{user}",
-            "value_template": "{{ value_json.playtime_spent_day }}",
+            "state_topic": state_topic,
+            "value_template": value_template,
             "unit_of_measurement": "s",
             "state_class": "measurement",
             "device_class": "duration",
             "unique_id": f"timekpr_{server}_{user}_playtime",
         },
         platform = "sensor",
+        server = server,
+        user = user,
     )
 
+def _parse_stats_values(text: str) -> Dict[str, str]:
+    values = {}
+    for line in text.splitlines():
+        if '=' in line:
+            k, v = line.split('=', 1)
+            values[k.strip()] = v.strip()
+    return values
+
+
+def _note_user_activity(server: str, user: str, time_spent_day: int, checked_dt: datetime) -> None:
+    """
+    A user is active when TIME_SPENT_DAY grew and the stats file was written recently.
+    """
+    key = f"{server}/{user}"
+    fresh = datetime.now() - checked_dt < timedelta(seconds=SYNC_ACTIVITY_FRESHNESS)
+    with _activity_lock:
+        previous = _last_time_spent.get(key)
+        _last_time_spent[key] = time_spent_day
+        if fresh and previous is not None and time_spent_day > previous:
+            _active_servers.add(server)
+
+
+def _take_server_activity(server: str) -> bool:
+    with _activity_lock:
+        active = server in _active_servers
+        _active_servers.discard(server)
+    return active
+
+
+# aggregated mode: server -> user -> last published state
+_server_stats: Dict[str, Dict[str, dict]] = {}
+_server_stats_lock = threading.Lock()
+
+
 def _update_user_history(server: str, user: str, stats_file: Path, updated: bool, client) -> None:
     """
     Extract TIME_SPENT_DAY and PLAYTIME_SPENT_DAY and update rolling history.
     """
     global server_user_list
-    if not stats_file.exists():
+    values = stats_cache.get(stats_file, _parse_stats_values)
+    if values is None:
         logger.warning(f"No stats file found for {server} / {user} to read daily usage")
         return
 
-    values = {}
-    for line in stats_file.read_text().splitlines():
-        if '=' in line:
-            k, v = line.split('=', 1)
-            values[k.strip()] = v.strip()
-
     try:
         last_checked = values.get("LAST_CHECKED", "2000-01-01 01:13:08")
         checked_dt = datetime.strptime(last_checked, "%Y-%m-%d %H:%M:%S")
@@ -354,85 +836,118 @@ def _update_user_history(server: str, user: str, stats_file: Path, updated: bool
     except ValueError:
         logger.warning(f"ValueError on reading daily usage for {server} / {user}")        
         return
+    _note_user_activity(server, user, time_spent_day, checked_dt)
     if updated:
-        update_daily_usage(
-            server=server,
-            user=user,
-            time_spent_day=time_spent_day,
-            playtime_spent_day=playtime_spent_day,
-        )
+        start = time.perf_counter()
+        with tracer.span("history_write"):
+            update_daily_usage(
+                server=server,
+                user=user,
+                time_spent_day=time_spent_day,
+                playtime_spent_day=playtime_spent_day,
+            )
+        HISTORY_WRITE_SECONDS.observe(time.perf_counter() - start)
+        if checked_dt.date() == date.today():
+            record_sample(server, user, checked_dt, time_spent_day, playtime_spent_day)
     
-    if not (f"{server}/{user}") in server_user_list:
+    with _registration_lock:
+        first_seen = not (f"{server}/{user}") in server_user_list
+        if first_seen:
+            server_user_list.append(f"{server}/{user}")
+    if first_seen:
         register_user_sensors(server, user)
-        server_user_list.append(f"{server}/{user}")
+
+    state = {
+        "time_spent_day": time_spent_day,
+        "playtime_spent_day": playtime_spent_day,
+        "time_spent_week": _int_value(values, "TIME_SPENT_WEEK"),
+        "time_spent_month": _int_value(values, "TIME_SPENT_MONTH"),
+        "time_spent_balance": _int_value(values, "TIME_SPENT_BALANCE"),
+        "playtime_spent_balance": _int_value(values, "PLAYTIME_SPENT_BALANCE"),
+    }
+    if MQTT_AGGREGATE:
+        # published with the other users of the server in _publish_server_stats
+        with _server_stats_lock:
+            _server_stats.setdefault(server, {})[user] = state
+        return
 
     # MQTT publish actual time usage / user
     publish(
         f"stats/{server}/{user}",
-        {
-            "time_spent_day": time_spent_day,
-            "playtime_spent_day": playtime_spent_day,
-        },
+        state,
         qos=1,
         retain=False,
     )
 
+
+def _int_value(values: Dict[str, str], key: str) -> int:
+    try:
+        return int(values.get(key, 0))
+    except ValueError:
+        return 0
+
+
+def _publish_server_stats(server: str, configured_users) -> None:
+    """
+    Aggregated mode: one stats/<server> document with the last known state of every user.
+    """
+    with _server_stats_lock:
+        known = _server_stats.get(server, {})
+        users = {user: dict(known[user]) for user in sorted(configured_users) if user in known}
+    if users:
+        publish(f"stats/{server}", {"users": users}, qos=1, retain=False)
+
 # -------------------------------------------------------------------
 # Download logic
 # -------------------------------------------------------------------
 
-def sync_from_server(server_name: str, server: Dict) -> bool:
+def sync_from_server(server_name: str, server: Dict, users: set[str] | None = None) -> bool:
     """
-    Pull all known configs from a server.
+    Pull all known configs from a server, or only the files of `users`.
     Returns True if server was reachable.
     """
-    global server_user_list
-    client = _connect(server, server_name)
-
-    if not client:
-        return False
+    with ssh_pool.connection(server_name, server) as conn:
+        if conn is None:
+            return False
 
-    try:
-        sftp = client.open_sftp()
+        client = conn.client
+        sftp = conn.sftp
+        sftp.get_channel().settimeout(SYNC_DOWNLOAD_TIMEOUT)
         paths = get_remote_paths(server_name)
 
+        files: list[tuple[str, Path]] = []
+
         # --- server config ---
-        if "server" in paths:
-            updated = _scp_get_if_changed(
-                sftp,
-                paths["server"],
-                server_cache_dir(server_name) / "server.conf",
-            )
-            if updated:
-                logger.debug(f"[{server_name}] server.conf updated")
+        if "server" in paths and users is None:
+            files.append((paths["server"], server_cache_dir(server_name) / "server.conf"))
 
         # --- user configs ---
         for user, remote_path in paths.get("users", {}).items():
-            updated = _scp_get_if_changed(
-                sftp,
-                remote_path,
-                user_cache_dir(server_name) / f"{user}.conf",
-            )
-            if updated:
-                logger.debug(f"[{server_name}] user {user} config updated")
+            if users is None or user in users:
+                files.append((remote_path, user_cache_dir(server_name) / f"{user}.conf"))
 
         # --- stats ---
+        stats_files = {}
         for user, remote_path in paths.get("stats", {}).items():
+            if users is not None and user not in users:
+                continue
             local = stats_cache_dir(server_name) / f'{user}.stats'
-            updated = _scp_get_if_changed(
-                sftp,
-                remote_path,
-                local,
-            )
-            _update_user_history(server_name, user, local, updated, client)
-            if updated:
-                logger.debug(f"[{server_name}] stats for {user} updated")
+            files.append((remote_path, local))
+            stats_files[user] = local
 
+        # metadata of every known file in one round-trip, then fetch only what changed
+        with tracer.span("probe"):
+            probe = _probe_remote_files(client, [remote for remote, _ in files], SYNC_PROBE_HASH)
+        updated_files = _download_changed(client, sftp, files, probe)
+        for local in updated_files:
+            logger.debug(f"[{server_name}] {local.relative_to(server_cache_dir(server_name))} updated")
+            _count_transfer(server_name, "download", local)
 
-        return True
+        for user, local in stats_files.items():
+            _update_user_history(server_name, user, local, local in updated_files, client)
 
-    finally:
-        client.close()
+
+        return True
 
 
 # -------------------------------------------------------------------
@@ -444,129 +959,553 @@ def upload_pending(server_name: str, server: Dict) -> bool:
     Upload pending changes if server is reachable.
     """
     logger.debug("ssh upload pending started")
-    client = _connect(server, server_name)
     success = True
-    if not client:
-        return False
 
     try:
-        sftp = client.open_sftp()
-        paths = get_remote_paths(server_name)
-
-        # --- server config ---
-        server_file = pending_dir(server_name) / "server.conf"
-        if server_file.exists():
-            if _scp_put(sftp, server_file, paths["server"]):
-                server_file.unlink()
-                logger.debug(f"[{server_name}] uploaded server.conf")
-            else:
-                success = False
-
-        # --- user configs ---
-        for file in pending_user_dir(server_name).glob("*.conf"):
-            username = file.stem
-            remote = paths.get("users", {}).get(username)
-            if remote:
-                if _scp_put(sftp, file, remote):
-                    file.unlink()
-                    logger.debug(f"[{server_name}] uploaded user {username}")
+        with ssh_pool.connection(server_name, server) as conn:
+            if conn is None:
+                return False
+
+            client = conn.client
+            sftp = conn.sftp
+            sftp.get_channel().settimeout(SYNC_UPLOAD_TIMEOUT)
+            paths = get_remote_paths(server_name)
+
+            # --- server config ---
+            server_file = pending_dir(server_name) / "server.conf"
+            if server_file.exists():
+                if _scp_put(sftp, server_file, paths["server"]):
+                    _count_transfer(server_name, "upload", server_file)
+                    server_file.unlink()
+                    logger.debug(f"[{server_name}] uploaded server.conf")
                 else:
                     success = False
 
-        # --- stats ---
-        logger.debug("ssh upload check for stats file")
-        for file in pending_stats_dir(server_name).glob("*.stats"):
-            logger.debug(f"ssh upload check for stats file passed: {file}")
-            username = file.stem
-            logger.debug(f"ssh upload check for stats file fouind for {server_name} {username}")
-            if _ssh_update_allowance(client, file, username):
-                file.unlink()
-                logger.debug(f"[{server_name}] updated allowance for {username}")
-            else:
-                logger.warning("ssh upload tats file failed")
-                success = False
-    except:
+            # --- user configs ---
+            for file in pending_user_dir(server_name).glob("*.conf"):
+                username = file.stem
+                remote = paths.get("users", {}).get(username)
+                if remote:
+                    if _scp_put(sftp, file, remote):
+                        _count_transfer(server_name, "upload", file)
+                        file.unlink()
+                        logger.debug(f"[{server_name}] uploaded user {username}")
+                    else:
+                        success = False
+
+            # --- stats (all pending allowance changes in one remote script) ---
+            logger.debug("ssh upload check for stats file")
+            with _grant_lock:
+                # what is sent; grants queued while the script runs are summed into the files
+                sent = {
+                    file: (file.read_text(), _pending_grant(file))
+                    for file in sorted(pending_stats_dir(server_name).glob("*.stats"))
+                }
+            if sent:
+                with tracer.span("allowances"):
+                    results = _ssh_update_allowances(client, {file: text for file, (text, _) in sent.items()})
+                for file, applied in results.items():
+                    if applied:
+                        _settle_grant(file, *sent[file])
+                        logger.debug(f"[{server_name}] updated allowance for {file.stem}")
+                    else:
+                        logger.warning(f"[{server_name}] allowance update for {file.stem} failed")
+                        success = False
+    except SyncTimeout as e:
+        logger.warning(f"[{server_name}] upload of pending changes: {e}")
         success = False
+    except Exception as e:
+        logger.warning(f"[{server_name}] upload of pending changes failed: {e}")
+        success = False
+
+    return success
 
-    finally:
-        client.close()
-        return success
 
+class SyncTriggerQueue:
+    """
+    Scoped sync requests, coalesced until the sync loop picks them up.
+
+    A request is either the whole fleet, one server or one user of a server;
+    requests for the same server are merged, a wider scope absorbs a narrower one.
+    """
 
-def trigger_ssh_sync():
-    logger.debug("Manual SSH sync triggered")
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._full = False
+        # server name -> users to sync, None means the whole server
+        self._servers: Dict[str, set[str] | None] = {}
+        self._last_request = 0.0
+
+    def put(self, server_name: str | None = None, username: str | None = None) -> None:
+        with self._lock:
+            if server_name is None:
+                self._full = True
+            elif username is None:
+                self._servers[server_name] = None
+            elif server_name not in self._servers:
+                self._servers[server_name] = {username}
+            elif self._servers[server_name] is not None:
+                self._servers[server_name].add(username)
+            self._last_request = time.monotonic()
+
+    def quiet_for(self) -> float:
+        """
+        Seconds since the last request.
+        """
+        with self._lock:
+            return time.monotonic() - self._last_request
+
+    def drain(self) -> tuple[bool, Dict[str, set[str] | None]]:
+        """
+        Take all pending requests: (full fleet requested, per-server scopes).
+        """
+        with self._lock:
+            full, servers = self._full, self._servers
+            self._full = False
+            self._servers = {}
+        return full, servers
+
+
+sync_triggers = SyncTriggerQueue()
+
+
+def trigger_ssh_sync(server_name: str | None = None, username: str | None = None):
+    """
+    Request a sync: of every server, of one server, or of one user on a server.
+    """
+    logger.debug(f"Manual SSH sync triggered (server: {server_name}, user: {username})")
+    sync_triggers.put(server_name, username)
     trigger_event.set()
 
 
+# -------------------------------------------------------------------
+# MQTT commands
+# -------------------------------------------------------------------
+# largest grant (or deduction) of time or playtime accepted in one command
+COMMAND_MAX_GRANT = 24 * 3600
+COMMAND_RESULT_TOPIC = "command_result"
+# pending allowance files are rewritten by commands arriving on the MQTT thread
+_grant_lock = threading.Lock()
+
+
+def _pending_grant(path: Path) -> tuple[int, int]:
+    """
+    (time, playtime) seconds of a pending allowance file written today, (0, 0) otherwise.
+    """
+    if not path.exists() or not _is_file_modified_today(path):
+        return 0, 0
+    amounts = {"--settimeleft": 0, "--setplaytimeleft": 0}
+    for raw in path.read_text().splitlines():
+        try:
+            _, option, _, sign, seconds = shlex.split(raw)
+            amounts[option] += int(seconds) if sign == "+" else -int(seconds)
+        except (ValueError, KeyError):
+            logger.warning(f"Unexpected line in pending allowance file {path}: {raw}")
+    return amounts["--settimeleft"], amounts["--setplaytimeleft"]
+
+
+def _write_grant(target: Path, time_sec: int, playtime_sec: int) -> None:
+    """
+    Called with _grant_lock held.
+    """
+    lines = []
+    for option, seconds in (("--settimeleft", time_sec), ("--setplaytimeleft", playtime_sec)):
+        sign = "+" if seconds >= 0 else "-"
+        lines.append(f'timekpra {option} "{target.stem}" "{sign}" "{abs(seconds)}"')
+    target.write_text("\n".join(lines) + "\n")
+
+
+def _settle_grant(path: Path, sent_text: str, sent_grant: tuple[int, int]) -> None:
+    """
+    Remove an applied allowance file; a grant queued while it was uploaded stays pending.
+    """
+    with _grant_lock:
+        try:
+            if path.read_text() == sent_text:
+                path.unlink()
+                return
+        except FileNotFoundError:
+            return
+        pending_time, pending_playtime = _pending_grant(path)
+        remaining = (pending_time - sent_grant[0], pending_playtime - sent_grant[1])
+        if remaining == (0, 0):
+            path.unlink()
+        else:
+            _write_grant(path, *remaining)
+
+
+def queue_extra_time(server_name: str, username: str, time_sec: int = 0, playtime_sec: int = 0) -> None:
+    """
+    Add time / playtime to the user's pending allowance change (summed with one that is not
+    uploaded yet) and request a sync of that user.
+    """
+    target = pending_stats_dir(server_name) / f"{username}.stats"
+    with _grant_lock:
+        pending_time, pending_playtime = _pending_grant(target)
+        _write_grant(target, time_sec + pending_time, playtime_sec + pending_playtime)
+    trigger_ssh_sync(server_name, username)
+
+
+def _command_seconds(payload: bytes) -> int:
+    """
+    Seconds of a grant command: a plain number or {"seconds": n}.
+    """
+    value = json.loads(payload.decode())
+    if isinstance(value, dict):
+        value = value.get("seconds")
+    # Infinity / NaN parse as floats, but have no int value
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value != int(value):
+        raise ValueError("expected a whole number of seconds")
+    seconds = int(value)
+    if abs(seconds) > COMMAND_MAX_GRANT:
+        raise ValueError(f"at most {COMMAND_MAX_GRANT} seconds per command")
+    return seconds
+
+
+def _run_command(parts: list[str], payload: bytes) -> str:
+    """
+    Validate and run one command, returns what was done.
+    """
+    servers = load_servers()
+    if len(parts) == 2 and parts[1] == "sync":
+        if parts[0] not in servers:
+            raise ValueError(f"unknown server {parts[0]}")
+        trigger_ssh_sync(parts[0])
+        return f"sync of {parts[0]} requested"
+
+    if len(parts) == 3 and parts[2] in ("grant_time", "grant_playtime"):
+        server_name, username, command = parts
+        if server_name not in servers:
+            raise ValueError(f"unknown server {server_name}")
+        if username not in servers[server_name].get("users", {}):
+            raise ValueError(f"unknown user {username} on {server_name}")
+        seconds = _command_seconds(payload)
+        if command == "grant_time":
+            queue_extra_time(server_name, username, time_sec=seconds)
+        else:
+            queue_extra_time(server_name, username, playtime_sec=seconds)
+        return f"{command} {seconds:+d}s for {username} on {server_name} queued"
+
+    raise ValueError("unknown command")
+
+
+def _on_mqtt_command(topic: str, payload: bytes, retained: bool) -> None:
+    """
+    command/<server>/sync, command/<server>/<user>/grant_time and .../grant_playtime.
+    """
+    # a retained command would be run again on every reconnect
+    if retained:
+        logger.warning(f"Ignoring retained MQTT command on {topic}")
+        return
+    parts = topic.split("/")[1:]
+    try:
+        done = _run_command(parts, payload)
+        logger.info(f"MQTT command {topic}: {done}")
+        result = {"command": topic, "ok": True, "result": done}
+    except (ValueError, UnicodeDecodeError) as e:
+        logger.warning(f"MQTT command {topic} rejected: {e}")
+        result = {"command": topic, "ok": False, "error": str(e)}
+    publish(COMMAND_RESULT_TOPIC, result, qos=1, retain=False, force=True)
+
+
+def register_mqtt_commands() -> None:
+    if MQTT_COMMANDS:
+        subscribe("command/#", _on_mqtt_command)
+        logger.info("MQTT commands enabled")
+
+
+def _wait_for_quiet_triggers(stop_event) -> None:
+    """
+    Debounce: wait until no new trigger arrived for SYNC_TRIGGER_DEBOUNCE seconds.
+    """
+    while not stop_event.is_set():
+        remaining = SYNC_TRIGGER_DEBOUNCE - sync_triggers.quiet_for()
+        if remaining <= 0:
+            return
+        stop_event.wait(remaining)
+
+
 # -------------------------------------------------------------------
 # Periodic runner
 # -------------------------------------------------------------------
+def _sync_server(name: str, server: Dict, users: set[str] | None = None, requested: bool = False) -> bool:
+    """
+    Run the upload and download phases for a single server (optionally only for `users`).
+    `requested`: triggered explicitly, tried even if the circuit is open.
+    Executed on a worker thread, returns True if the server was reachable.
+    """
+    with tracer.server(name):
+        return _sync_server_phases(name, server, users, requested)
+
+
+def _sync_server_phases(name: str, server: Dict, users: set[str] | None, requested: bool = False) -> bool:
+    breaker = circuit_breakers.get(name)
+    opened = False
+    if not breaker.allow(requested=requested):
+        # open circuit: no connection attempt and no re-parsing of the stale stats
+        logger.debug(f"[{name}] circuit open, skipped")
+        reachable = False
+    else:
+        reachable = upload_pending(name, server)
+        if ssh_pool.has_connection(name):
+            breaker.record_success()
+        else:
+            opened = breaker.record_failure()
+
+    if reachable:
+        sync_from_server(name, server, users)
+    elif breaker.state == CLOSED or opened:
+        # refresh from the cached stats while closed and once when the circuit opens
+        paths = get_remote_paths(name)
+        for user, remote_path in paths.get("stats", {}).items():
+            if users is not None and user not in users:
+                continue
+            local = stats_cache_dir(name) / f'{user}.stats'
+            _update_user_history(name, user, local, False, None)
+
+    if MQTT_AGGREGATE:
+        _publish_server_stats(name, server.get("users", {}))
+
+    # independently if the server is reachable let's register it in Home Assistant
+    with _registration_lock:
+        first_seen = not name in server_list
+        if first_seen:
+            server_list.append(name)
+    if first_seen:
+        register_server_sensors(name)
+    return reachable
+
+
+def _plan_cycle(
+    servers: Dict,
+    full: bool,
+    targets: Dict[str, set[str] | None],
+    due: list[str],
+) -> Dict[str, set[str] | None]:
+    """
+    Servers (and user scopes) to sync in this cycle: everything on a full
+    request, otherwise the servers due by the scheduler plus the triggered ones.
+    """
+    if full:
+        return {name: None for name in servers}
+    plan = {name: users for name, users in targets.items() if name in servers}
+    for name in due:
+        if name in servers:
+            plan[name] = None
+    return plan
+
+
+def _merge_online(servers: Dict, attempted, reachable: set[str]) -> list[str]:
+    """
+    New online list: fresh result for the servers synced now, previous state for the rest.
+    Returned in servers.json order.
+    """
+    previous = set(servers_online.get_value())
+    return [
+        name for name in servers
+        if name in reachable or (name not in attempted and name in previous)
+    ]
+
+
+def _complete_plan(servers: Dict, plan: Dict[str, set[str] | None], reachable: set[str]) -> list[str]:
+    """
+    Schedule the next poll of every fully synced server and return the new online list.
+    """
+    for name, users in plan.items():
+        if users is None:
+            poll_scheduler.reschedule(
+                name,
+                reachable=name in reachable,
+                active=_take_server_activity(name),
+                retry_in=circuit_breakers.get(name).seconds_until_retry(),
+            )
+    return _merge_online(servers, plan, reachable)
+
+
+def _abandon_overdue(futures: Dict[Future, str], plan: Dict[str, set[str] | None]) -> set[str]:
+    """
+    Past the cycle deadline. Servers still syncing: close their connection, which makes
+    the blocked SSH call on the worker fail, and count it as a failure. Servers still
+    waiting for a worker never started: cancel them and sync them in the next cycle.
+    Returns the cancelled servers.
+    """
+    cancelled = set()
+    for future, name in futures.items():
+        if future.cancel():
+            cancelled.add(name)
+            users = plan[name]
+            for user in (users or [None]):
+                sync_triggers.put(name, user)
+            continue
+        logger.warning(f"[{name}] sync timed out after the {SYNC_CYCLE_TIMEOUT:.0f}s cycle deadline, abandoned")
+        ssh_pool.discard(name)
+        circuit_breakers.get(name).record_failure()
+    if cancelled:
+        logger.warning(
+            f"{len(cancelled)} server(s) did not get a worker before the {SYNC_CYCLE_TIMEOUT:.0f}s "
+            f"cycle deadline, moved to the next cycle"
+        )
+        trigger_event.set()
+    return cancelled
+
+
+def _run_cycle(
+    executor: ThreadPoolExecutor,
+    servers: Dict,
+    plan: Dict[str, set[str] | None],
+    requested: set[str] = frozenset(),
+) -> list[str]:
+    """
+    Sync the planned servers on the worker pool, within the cycle deadline.
+    `requested` servers were triggered explicitly (they get through an open circuit).
+    Returns the online servers, in servers.json order.
+    """
+    futures = {
+        executor.submit(_sync_server, name, servers[name], users, name in requested): name
+        for name, users in plan.items()
+    }
+
+    reachable = set()
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=SYNC_CYCLE_TIMEOUT):
+            pending.discard(future)
+            name = futures[future]
+            try:
+                if future.result():
+                    reachable.add(name)
+            except SyncTimeout as e:
+                logger.warning(f"[{name}] {e}")
+            except Exception:
+                logger.exception(f"[{name}] server sync failed")
+    except FuturesTimeoutError:
+        cancelled = _abandon_overdue({future: futures[future] for future in pending}, plan)
+        # not attempted: no reschedule, the online state stays as it was
+        plan = {name: users for name, users in plan.items() if name not in cancelled}
+
+    return _complete_plan(servers, plan, reachable)
+
+
+# Track the last time a backup was performed
+_last_backup_date = None
+
+
+def _run_daily_backup() -> None:
+    global _last_backup_date
+    now = datetime.now()
+    # If it's 11 PM and we haven't backed up today yet
+    if now.hour == 23 and _last_backup_date != now.date():
+        logger.info(f"Triggering scheduled daily backup at {now.strftime('%H:%M:%S')}")
+        try:
+            create_backup()
+            _last_backup_date = now.date()
+        except Exception as backup_err:
+            logger.error(f"Scheduled backup failed: {backup_err}")
+
+
+def _finish_cycle(servers: Dict, online_servers: list[str], cycle_start: float, synced: int) -> None:
+    """
+    Publish the results of a sync cycle.
+    """
+    hash_index.save()
+    with _server_stats_lock:
+        for name in [n for n in _server_stats if n not in servers]:
+            del _server_stats[name]
+    removed = prune_discovery(servers)
+    if removed:
+        # a server or user added again later has to be announced again
+        with _registration_lock:
+            for server, user in removed:
+                key = server if user is None else f"{server}/{user}"
+                for registered in (server_list, server_user_list):
+                    if key in registered:
+                        registered.remove(key)
+    servers_online.set_value(online_servers)
+    change_upload_is_pending.set_value(_tree_has_any_file(PENDING_DIR))
+    # MQTT publish online server list
+    publish(
+        "servers/online",
+        {
+            "servers": servers_online.get_value(),
+            "circuit": circuit_breakers.states(),
+        },
+        qos=1,
+        retain=True,
+    )
+
+    # --- Daily Backup Logic ---
+    _run_daily_backup()
+
+    cycle_duration = time.monotonic() - cycle_start
+    tracer.record(CYCLE_PHASE, cycle_duration)
+    SYNC_CYCLE_SECONDS.observe(cycle_duration)
+    SYNC_CYCLES.inc()
+    logger.info(
+        f"Sync of {synced}/{len(servers)} server(s) finished in {cycle_duration:.2f}s "
+        f"({len(online_servers)} servers online)"
+    )
+    sync_heartbeat.beat(cycle_duration)
+
+
+def _idle_tick() -> None:
+    """
+    Woke up with nothing due: keep the backup schedule and the heartbeat going.
+    """
+    _run_daily_backup()
+    sync_heartbeat.beat()
+
+
+def _next_wait(interval_seconds: float) -> float:
+    """
+    Seconds until the next server is due, waking at least once per interval.
+    """
+    until_next = poll_scheduler.seconds_until_next()
+    if until_next is None:
+        return interval_seconds
+    return min(until_next, interval_seconds)
+
+
 def run_sync_loop_with_stop(stop_event, interval_seconds: int = 180) -> None:
-    global change_upload_is_pending
-    global servers_online
-    global server_list
-    global sync_heartbeat
     logger.debug("SSH sync loop started")
-    success = True
-    sync_heartbeat.set_timeout(interval_seconds * 2)
+    poll_scheduler.normal_interval = interval_seconds
+    sync_heartbeat.set_timeout(max(interval_seconds, poll_scheduler.longest_interval) * 2)
 
-    # Track the last time a backup was performed
-    last_backup_date = None
+    executor = ThreadPoolExecutor(
+        max_workers=SYNC_MAX_WORKERS,
+        thread_name_prefix="SSH-Sync-Worker",
+    )
+    logger.info(f"SSH sync worker pool started with {SYNC_MAX_WORKERS} workers")
+    register_mqtt_commands()
 
     while not stop_event.is_set():
+        # clear trigger before taking the requests, a later trigger wakes the next wait
+        trigger_event.clear()
+        full, targets = sync_triggers.drain()
         try:
-            online_servers = []
+            cycle_start = time.monotonic()
             servers = load_servers()
-    
-            for name, server in servers.items():
-                reachable = upload_pending(name, server)
-                if reachable:
-                    online_servers.append(name)
-                    sync_from_server(name, server)
-                else:
-                    paths = get_remote_paths(name)
-                    for user, remote_path in paths.get("stats", {}).items():
-                        local = stats_cache_dir(name) / f'{user}.stats'
-                        _update_user_history(name, user, local, False, None)
-                # independently if the server is reachable let's register it in Home Assistant
-                if not name in server_list:
-                    register_server_sensors(name)
-                    server_list.append(name)
-            
-            
-            servers_online.set_value(online_servers)
-            change_upload_is_pending.set_value(_tree_has_any_file(PENDING_DIR))
-            # MQTT publish online server list
-            publish(
-                "servers/online",
-                {
-                    "servers": servers_online.get_value(),
-                },
-                qos=1,
-                retain=True,
-            )
-
-            # --- Daily Backup Logic ---
-            now = datetime.now()
-            # If it's 11 PM and we haven't backed up today yet
-            if now.hour == 23 and last_backup_date != now.date():
-                logger.info(f"Triggering scheduled daily backup at {now.strftime('%H:%M:%S')}")
-                try:
-                    create_backup()
-                    last_backup_date = now.date()
-                except Exception as backup_err:
-                    logger.error(f"Scheduled backup failed: {backup_err}")
-            
-            sync_heartbeat.beat()
+            poll_scheduler.sync_servers(servers.keys(), cycle_start)
+            plan = _plan_cycle(servers, full, targets, poll_scheduler.pop_due(cycle_start))
+            if plan:
+                ssh_pool.prune(servers.keys())
+                circuit_breakers.prune(servers.keys())
+                tracer.begin_cycle()
+                requested = set(plan) if full else set(targets) & set(plan)
+                online_servers = _run_cycle(executor, servers, plan, requested)
+                _finish_cycle(servers, online_servers, cycle_start, len(plan))
+            else:
+                _idle_tick()
             
         except:
             logger.exception("SSH sync loop iteration failed (will retry)")
-            
-        # clear trigger before waiting
-        trigger_event.clear()
 
         # wait until either:
-        # - interval expires
-        # - trigger_event is set
+        # - the next server is due (or the interval expires)
+        # - trigger_event is set (then let a burst of triggers settle)
         # - stop_event is set
-        triggered = trigger_event.wait(interval_seconds)
+        if trigger_event.wait(_next_wait(interval_seconds)):
+            _wait_for_quiet_triggers(stop_event)
+
+    executor.shutdown(wait=False, cancel_futures=True)
+    ssh_pool.close_all()
+    logger.info("SSH sync loop stopped")
@@ -0,0 +1,52 @@
+# stats_cache.py
+"""
+Parse-once cache of the cached Timekpr stats files.
+
+The sync loop and the stats dashboard both read the same *.stats files;
+each file is parsed once per change instead of on every cycle / page view.
+Entries are keyed by path and parser and validated against the file's
+mtime and size; the sync engine invalidates a path whenever it writes it.
+"""
+
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class StatsCache:
+    def __init__(self):
+        self._entries: Dict[Tuple[str, Callable], Tuple[int, int, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: Path, parser: Callable[[str], Any]) -> Any | None:
+        """
+        Parsed content of path, None if the file does not exist.
+        The returned object is shared, callers must not modify it.
+        """
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+
+        key = (str(path), parser)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2]
+
+        value = parser(path.read_text())
+        with self._lock:
+            self._entries[key] = (st.st_mtime_ns, st.st_size, value)
+        return value
+
+    def invalidate(self, path: Path) -> None:
+        name = str(path)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == name]:
+                del self._entries[key]
+
+
+stats_cache = StatsCache()
@@ -1,37 +1,293 @@
 # stats_history.py
+"""
+Usage history per user, with tiered retention.
 
+- daily values for DAILY_DAYS (90) days
+- weekly rollups (ISO weeks) for WEEKLY_WEEKS (two years)
+- monthly rollups forever
+
+A day is added to its week and month when it ages out of the daily tier,
+so the rollups grow incrementally and never need a rescan.
+
+Stored append-only as JSON lines (HISTORY_DIR/<server>/<user>.jsonl), one
+compact record per update, the last record of a key wins:
+    {"d": "YYYY-MM-DD", "t": time_spent, "p": playtime_spent}
+    {"w": "YYYY-Www", "t": ..., "p": ..., "n": days}     weekly rollup
+    {"m": "YYYY-MM", "t": ..., "p": ..., "n": days}      monthly rollup
+    {"r": "YYYY-MM-DD"}                                   days rolled up so far
+An update is a single append; the file is compacted (one record per key)
+once the superseded records pile up. Every file is indexed in memory on
+first use and re-read only when it changed on disk (e.g. after a restore).
+Files of the former JSON format (<user>.json) are migrated on first use.
+
+Export for inspection:
+    python -m stats_history export [--server S] [--user U] [--period day|week|month] [--format json|csv]
+"""
+
+import os
 import json
+import threading
 from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Tuple
 
-from storage import history_file
+from storage import history_file, HISTORY_DIR
 
-import logging 
+import logging
 logger = logging.getLogger(__name__)
 
-MAX_DAYS = 30
+DAILY_DAYS = 90
+WEEKLY_WEEKS = 104
+# superseded records tolerated before a compaction, about a day of 3-minute updates
+COMPACT_SLACK = 500
 
-def _load(path: Path) -> Dict[str, dict]:
-    if not path.exists():
-        logger.info(f"History stats file not found at {path}")
-        return {}
+
+def _line(record: dict) -> str:
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def _record(day: str, time_spent: int, playtime_spent: int) -> str:
+    return _line({"d": day, "t": time_spent, "p": playtime_spent})
+
+
+def _rollup_record(kind: str, key: str, values: Tuple[int, int, int]) -> str:
+    return _line({kind: key, "t": values[0], "p": values[1], "n": values[2]})
+
+
+def week_key(day: date) -> str:
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def week_start(key: str) -> date:
+    """
+    Monday of a week_key().
+    """
+    year, week = key.split("-W")
+    return date.fromisocalendar(int(year), int(week), 1)
+
+
+def month_key(day: date) -> str:
+    return f"{day.year}-{day.month:02d}"
+
+
+def _stat_key(path: Path) -> Tuple[int, int] | None:
     try:
-        logger.info("History stats file is being read")
-        return json.loads(path.read_text())
-    except json.JSONDecodeError as e:
-        # Specifically catch JSON errors to see syntax issues
-        logger.error(f"History stats file JSON syntax error in {path}: {e}")
-        return {}
-    except Exception as e:
-        # Catch other errors (permission, etc.)
-        logger.error(f"History stats file Unexpected error reading {path}: {e}")
-        return {}
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class _UserHistory:
+    def __init__(self, path: Path):
+        self.path = path
+        # date -> (time_spent, playtime_spent)
+        self.days: Dict[str, Tuple[int, int]] = {}
+        # week / month key -> (time_spent, playtime_spent, days)
+        self.weeks: Dict[str, Tuple[int, int, int]] = {}
+        self.months: Dict[str, Tuple[int, int, int]] = {}
+        # last day added to the rollups
+        self.rolled_through = ""
+        self.lines = 0
+        self.stat: Tuple[int, int] | None = None
+
+
+class HistoryStore:
+    def __init__(self):
+        self._users: Dict[Tuple[str, str], _UserHistory] = {}
+        self._lock = threading.Lock()
+
+    # ---------------- loading ----------------
+
+    def _get(self, server: str, user: str) -> _UserHistory:
+        """
+        The indexed history of a user, (re)loaded if the file changed behind our back.
+        Called with the lock held.
+        """
+        key = (server, user)
+        entry = self._users.get(key)
+        path = history_file(server, user)
+        if entry is not None and entry.stat == _stat_key(path):
+            return entry
+
+        entry = _UserHistory(path)
+        if not path.exists():
+            self._migrate(entry)
+        else:
+            self._load(entry)
+        self._users[key] = entry
+        return entry
+
+    def _load(self, entry: _UserHistory) -> None:
+        try:
+            self._repair(entry.path)
+            with open(entry.path, encoding="utf-8") as f:
+                for line in f:
+                    entry.lines += 1
+                    try:
+                        self._apply(entry, json.loads(line))
+                    except (json.JSONDecodeError, KeyError, TypeError, ValueError, AttributeError):
+                        # e.g. a line cut short by a crash, dropped at the next compaction
+                        logger.warning(f"Skipping unreadable history record in {entry.path}: {line.strip()[:80]}")
+        except OSError as e:
+            logger.error(f"History stats file {entry.path} could not be read: {e}")
+        entry.stat = _stat_key(entry.path)
+        if any(self._age(entry)):
+            # days that aged out while nobody wrote (e.g. a restored backup), or expired weeks
+            self._rewrite(entry)
+
+    def _repair(self, path: Path) -> None:
+        """
+        Cut a last line left without its newline by a crash, later appends would be glued to it.
+        """
+        with open(path, "rb") as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                return
+            f.seek(0)
+            data = f.read()
+        keep = data.rfind(b"\n") + 1
+        logger.warning(f"Dropping a partial record at the end of {path}: {data[keep:][:80]!r}")
+        os.truncate(path, keep)
+
+    def _apply(self, entry: _UserHistory, record: dict) -> None:
+        if "d" in record:
+            entry.days[record["d"]] = (int(record["t"]), int(record["p"]))
+        elif "w" in record:
+            entry.weeks[record["w"]] = (int(record["t"]), int(record["p"]), int(record["n"]))
+        elif "m" in record:
+            entry.months[record["m"]] = (int(record["t"]), int(record["p"]), int(record["n"]))
+        elif "r" in record:
+            entry.rolled_through = max(entry.rolled_through, str(record["r"]))
+        else:
+            raise KeyError("unknown record")
+
+    def _migrate(self, entry: _UserHistory) -> None:
+        """
+        Convert a <user>.json file of the former format, if there is one.
+        """
+        legacy = entry.path.with_suffix(".json")
+        if not legacy.exists():
+            return
+        try:
+            data = json.loads(legacy.read_text())
+            for day, values in data.items():
+                entry.days[day] = (int(values.get("time_spent", 0)), int(values.get("playtime_spent", 0)))
+        except (json.JSONDecodeError, OSError, AttributeError, ValueError) as e:
+            logger.error(f"History stats file {legacy} could not be migrated: {e}")
+            return
+        self._age(entry)
+        self._rewrite(entry)
+        legacy.unlink()
+        logger.info(f"Migrated history {legacy} to {entry.path.name} ({len(entry.days)} days)")
+
+    # ---------------- writing ----------------
+
+    def _age(self, entry: _UserHistory) -> tuple[list[str], bool]:
+        """
+        Move the days older than DAILY_DAYS into their week and month, drop the weeks that
+        started more than WEEKLY_WEEKS ago. Returns the records to append for the changed
+        rollups, and whether weeks were dropped (the file then needs a rewrite).
+        """
+        today = date.today()
+        oldest_day = (today - timedelta(days=DAILY_DAYS - 1)).isoformat()
+        lines = []
+        aged = [day for day in entry.days if day < oldest_day]
+        if aged:
+            touched = set()
+            for day in sorted(aged):
+                time_spent, playtime_spent = entry.days.pop(day)
+                # still in a file that was not compacted since it was rolled up
+                if day <= entry.rolled_through:
+                    continue
+                d = date.fromisoformat(day)
+                for kind, buckets, key in (("w", entry.weeks, week_key(d)), ("m", entry.months, month_key(d))):
+                    t, p, n = buckets.get(key, (0, 0, 0))
+                    buckets[key] = (t + time_spent, p + playtime_spent, n + 1)
+                    touched.add((kind, key))
+                entry.rolled_through = day
+            if touched:
+                for kind, key in sorted(touched):
+                    buckets = entry.weeks if kind == "w" else entry.months
+                    lines.append(_rollup_record(kind, key, buckets[key]))
+                lines.append(_line({"r": entry.rolled_through}))
+
+        oldest_week = today - timedelta(weeks=WEEKLY_WEEKS)
+        expired = [key for key in entry.weeks if week_start(key) < oldest_week]
+        for key in expired:
+            del entry.weeks[key]
+        return lines, bool(expired)
+
+    def _live_records(self, entry: _UserHistory) -> int:
+        return len(entry.days) + len(entry.weeks) + len(entry.months) + bool(entry.rolled_through)
 
+    def _rewrite(self, entry: _UserHistory) -> None:
+        """
+        Compaction: one record per key, replacing the file atomically.
+        """
+        lines = [_rollup_record("m", key, values) for key, values in sorted(entry.months.items())]
+        lines += [_rollup_record("w", key, values) for key, values in sorted(entry.weeks.items())]
+        if entry.rolled_through:
+            lines.append(_line({"r": entry.rolled_through}))
+        lines += [_record(day, t, p) for day, (t, p) in sorted(entry.days.items())]
 
-def _save(path: Path, data: Dict[str, dict]) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(data, indent=2, sort_keys=True))
+        entry.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = entry.path.with_suffix(".tmp")
+        tmp.write_text("".join(lines))
+        tmp.replace(entry.path)
+        entry.lines = len(lines)
+        entry.stat = _stat_key(entry.path)
+
+    def record(self, server: str, user: str, day: str, time_spent: int, playtime_spent: int) -> None:
+        with self._lock:
+            entry = self._get(server, user)
+            if entry.days.get(day) == (time_spent, playtime_spent):
+                return
+            entry.days[day] = (time_spent, playtime_spent)
+            rollups, expired = self._age(entry)
+            lines = [_record(day, time_spent, playtime_spent)] + rollups
+
+            # expired weeks can only leave the file with a rewrite
+            if expired or entry.lines + len(lines) - self._live_records(entry) >= COMPACT_SLACK:
+                self._rewrite(entry)
+                return
+            entry.path.parent.mkdir(parents=True, exist_ok=True)
+            # one write: the rollups and their "rolled through" marker go together
+            with open(entry.path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+            entry.lines += len(lines)
+            entry.stat = _stat_key(entry.path)
+
+    def compact(self, server: str, user: str) -> None:
+        with self._lock:
+            entry = self._get(server, user)
+            if entry.path.exists() and entry.lines != self._live_records(entry):
+                self._rewrite(entry)
+
+    # ---------------- reading ----------------
+
+    def days(self, server: str, user: str) -> Dict[str, Tuple[int, int]]:
+        """
+        date -> (time_spent, playtime_spent) of the kept days, oldest first.
+        """
+        with self._lock:
+            entry = self._get(server, user)
+            return dict(sorted(entry.days.items()))
+
+    def rollups(self, server: str, user: str, period: str) -> Dict[str, Tuple[int, int, int]]:
+        """
+        week / month key -> (time_spent, playtime_spent, days) of the days that left the daily tier.
+        """
+        with self._lock:
+            entry = self._get(server, user)
+            buckets = entry.weeks if period == "week" else entry.months
+            return dict(sorted(buckets.items()))
+
+
+history_store = HistoryStore()
 
 
 def update_daily_usage(
@@ -42,26 +298,14 @@ def update_daily_usage(
     playtime_spent_day: int,
 ) -> None:
     """
-    Update rolling 30-day daily usage history.
+    Record today's usage; days older than DAILY_DAYS move into the weekly / monthly rollups.
     """
-    path = history_file(server, user)
-    history = _load(path)
-
-    today = date.today().isoformat()
-    history[today] = {
-        "time_spent": time_spent_day,
-        "playtime_spent": playtime_spent_day,
-    }
+    history_store.record(server, user, date.today().isoformat(), time_spent_day, playtime_spent_day)
 
-    # prune old entries
-    for d in sorted(history.keys())[:-MAX_DAYS]:
-        history.pop(d, None)
-
-    _save(path, history)
-
-def get_user_history(server: str, user: str) -> dict[str, dict]:
+def get_user_history(server: str, user: str, days: int | None = None) -> dict[str, dict]:
     """
-    Returns a date-indexed history for a user with gaps filled.
+    Returns a date-indexed history for a user with gaps filled, the last `days` days
+    (all of the daily tier if None).
     {
         "YYYY-MM-DD": {
             "time_spent": int,
@@ -69,40 +313,118 @@ def get_user_history(server: str, user: str) -> dict[str, dict]:
         }
     }
     """
-    
-    path = history_file(server, user)
-    raw_history = _load(path)
+
+    raw_history = history_store.days(server, user)
 
     if not raw_history:
         logger.warning("No history stats read returned empty")
         return {}
 
-    # Parse available dates
-    parsed_dates = sorted(
-        datetime.strptime(d, "%Y-%m-%d").date()
-        for d in raw_history.keys()
-    )
-
-    start_date = parsed_dates[0]
+    # Parse available dates (already sorted)
+    start_date = datetime.strptime(next(iter(raw_history)), "%Y-%m-%d").date()
     end_date = date.today()
+    if days is not None:
+        start_date = max(start_date, end_date - timedelta(days=days - 1))
 
     filled_history: dict[str, dict] = {}
 
     current = start_date
     while current <= end_date:
         key = current.isoformat()
+        time_spent, playtime_spent = raw_history.get(key, (0, 0))
+        filled_history[key] = {
+            "time_spent": time_spent,
+            "playtime_spent": playtime_spent,
+        }
+        current += timedelta(days=1)
+
+    return filled_history
 
-        if key in raw_history:
-            filled_history[key] = {
-                "time_spent": int(raw_history[key].get("time_spent", 0)),
-                "playtime_spent": int(raw_history[key].get("playtime_spent", 0)),
-            }
+
+def get_usage_trend(server: str, user: str, period: str = "month") -> dict[str, dict]:
+    """
+    Usage per week ("YYYY-Www") or month ("YYYY-MM"): the rollups plus the days still
+    in the daily tier. Weeks only reach back WEEKLY_WEEKS, months to the first record.
+    {
+        "YYYY-MM": {"time_spent": int, "playtime_spent": int, "days": int}
+    }
+    """
+    if period not in ("week", "month"):
+        raise ValueError(f"period must be 'week' or 'month', not {period!r}")
+    key_of = week_key if period == "week" else month_key
+
+    buckets = {key: list(values) for key, values in history_store.rollups(server, user, period).items()}
+    for day, (time_spent, playtime_spent) in history_store.days(server, user).items():
+        bucket = buckets.setdefault(key_of(date.fromisoformat(day)), [0, 0, 0])
+        bucket[0] += time_spent
+        bucket[1] += playtime_spent
+        bucket[2] += 1
+
+    return {
+        key: {"time_spent": t, "playtime_spent": p, "days": n}
+        for key, (t, p, n) in sorted(buckets.items())
+    }
+
+
+# -------------------------------------------------------------------
+# Export (python -m stats_history export)
+# -------------------------------------------------------------------
+
+def _history_users(server: str | None, user: str | None) -> list[Tuple[str, str]]:
+    users = set()
+    for path in HISTORY_DIR.glob("*/*.json*"):
+        if path.suffix in (".json", ".jsonl"):
+            users.add((path.parent.name, path.stem))
+    return sorted(
+        (s, u) for s, u in users
+        if (server is None or s == server) and (user is None or u == user)
+    )
+
+
+def main() -> None:
+    import csv
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect the usage history")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="write the history of all (or some) users to stdout")
+    export.add_argument("--server")
+    export.add_argument("--user")
+    export.add_argument("--period", choices=("day", "week", "month"), default="day")
+    export.add_argument("--format", choices=("json", "csv"), default="json")
+    sub.add_parser("compact", help="compact every history file (also migrates the former format)")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        for server, user in _history_users(None, None):
+            history_store.compact(server, user)
+            print(f"{server}/{user}: {len(history_store.days(server, user))} days")
+        return
+
+    rows = []
+    for server, user in _history_users(args.server, args.user):
+        if args.period == "day":
+            rows += [(server, user, day, t, p, 1) for day, (t, p) in history_store.days(server, user).items()]
         else:
-            filled_history[key] = {
-                "time_spent": 0,
-                "playtime_spent": 0,
-            }
+            rows += [
+                (server, user, key, v["time_spent"], v["playtime_spent"], v["days"])
+                for key, v in get_usage_trend(server, user, args.period).items()
+            ]
+    if args.format == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(("server", "user", args.period, "time_spent", "playtime_spent", "days"))
+        writer.writerows(rows)
+    else:
+        data: Dict[str, Dict[str, dict]] = {}
+        for server, user, key, t, p, n in rows:
+            values = {"time_spent": t, "playtime_spent": p}
+            if args.period != "day":
+                values["days"] = n
+            data.setdefault(server, {}).setdefault(user, {})[key] = values
+        json.dump(data, sys.stdout, indent=2)
+        print()
 
-        current += timedelta(days=1)
 
-    return filled_history
+if __name__ == "__main__":
+    main()
@@ -19,7 +19,8 @@ logger = logging.getLogger(__name__)
 # Root & directory layout (configurable)
 # -------------------------------------------------------------------
 
-DATA_ROOT: Path = Path('/data')  # default, can be overridden from main.py
+# default, can be overridden from main.py or with TIMEKPR_MNGR_DATA_ROOT (benchmarks)
+DATA_ROOT: Path = Path(os.getenv('TIMEKPR_MNGR_DATA_ROOT', '/data'))
 
 CACHE_DIR = DATA_ROOT / 'cache'
 KEYS_DIR = DATA_ROOT / 'ssh_keys'
@@ -28,6 +29,7 @@ SERVERS_FILE = DATA_ROOT / 'servers.json'
 HISTORY_DIR = DATA_ROOT / 'history'
 ADDON_CONFIG_FILE = DATA_ROOT / 'options.json'
 BACKUP_FILE = DATA_ROOT / 'backup.zip'
+DISCOVERY_FILE = DATA_ROOT / 'ha_discovery.json'
 
 CHANNEL = os.getenv("TIMEKPR_MNGR_CHANNEL", "unknown").lower()
 IS_EDGE = CHANNEL in ("edge", "unstable", "dev")
@@ -62,7 +64,7 @@ _ensure_dirs()
 # History helpers
 # -------------------------------------------------------------------
 def history_file(server: str, user: str) -> Path:
-    return HISTORY_DIR / server / f"{user}.json"
+    return HISTORY_DIR / server / f"{user}.jsonl"
 
 
 # -------------------------------------------------------------------
@@ -133,6 +135,17 @@ def get_admin_user_list() -> list():
     logger.info(f"Admin users list: {user_list}")
     return user_list
 
+def get_addon_section(section: str) -> dict:
+    """
+    Return one section of the add-on options, or {} if it is missing.
+    """
+    addon_options=load_json(ADDON_CONFIG_FILE, {})
+    value = addon_options.get(section, {})
+    if not isinstance(value, dict):
+        logger.warning(f"Add-on option section '{section}' is not a mapping, ignored")
+        return {}
+    return value
+
 
 # -------------------------------------------------------------------
 # Backup and restore
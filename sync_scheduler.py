@@ -0,0 +1,121 @@
+# sync_scheduler.py
+"""
+Adaptive per-server polling scheduler.
+
+Every server has its own next-due time, kept in a priority queue.
+Servers with active users are polled more often, idle and offline
+servers less often.
+"""
+
+import time
+import heapq
+import threading
+from typing import Dict, Iterable
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class PollScheduler:
+    def __init__(
+        self,
+        *,
+        active_interval: float,
+        normal_interval: float,
+        idle_interval: float,
+        offline_interval: float,
+        idle_after: float,
+    ):
+        self.active_interval = active_interval
+        self.normal_interval = normal_interval
+        self.idle_interval = idle_interval
+        self.offline_interval = offline_interval
+        self.idle_after = idle_after
+
+        self._heap: list[tuple[float, str]] = []
+        # authoritative due time per server, heap entries not matching it are stale
+        self._due: Dict[str, float] = {}
+        self._last_activity: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def longest_interval(self) -> float:
+        return max(self.active_interval, self.normal_interval, self.idle_interval, self.offline_interval)
+
+    def _push(self, name: str, due: float) -> None:
+        self._due[name] = due
+        heapq.heappush(self._heap, (due, name))
+
+    def sync_servers(self, names: Iterable[str], now: float | None = None) -> None:
+        """
+        Track the configured servers: new ones are due right away, removed ones are dropped.
+        """
+        now = time.monotonic() if now is None else now
+        names = set(names)
+        with self._lock:
+            for name in names - self._due.keys():
+                self._push(name, now)
+                self._last_activity[name] = now
+            for name in self._due.keys() - names:
+                del self._due[name]
+                self._last_activity.pop(name, None)
+
+    def pop_due(self, now: float | None = None) -> list[str]:
+        """
+        Servers whose poll is due. They get a provisional next poll after the
+        normal interval, so a failed cycle cannot drop them from the queue.
+        """
+        now = time.monotonic() if now is None else now
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                when, name = heapq.heappop(self._heap)
+                if self._due.get(name) == when:
+                    due.append(name)
+            for name in due:
+                self._push(name, now + self.normal_interval)
+        return due
+
+    def seconds_until_next(self, now: float | None = None) -> float | None:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - now)
+
+    def reschedule(
+        self,
+        name: str,
+        *,
+        reachable: bool,
+        active: bool,
+        retry_in: float | None = None,
+        now: float | None = None,
+    ) -> float:
+        """
+        Schedule the next poll of a server from the result of the current one.
+        retry_in (the circuit breaker backoff) replaces the offline interval.
+        Returns the chosen interval.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if name not in self._due:
+                # removed from servers.json meanwhile
+                return 0.0
+            if active:
+                self._last_activity[name] = now
+
+            if not reachable:
+                interval = self.offline_interval if retry_in is None else retry_in
+            elif active:
+                interval = self.active_interval
+            elif now - self._last_activity.get(name, now) >= self.idle_after:
+                interval = self.idle_interval
+            else:
+                interval = self.normal_interval
+
+            self._push(name, now + interval)
+        logger.debug(f"[{name}] next poll in {interval:.0f}s")
+        return interval
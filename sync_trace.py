@@ -0,0 +1,177 @@
+# sync_trace.py
+"""
+Lightweight tracing of the sync cycles.
+
+Responsibilities:
+- Time the phases of a server sync (connect, SFTP session, probe, downloads,
+  allowance updates, history writes, MQTT publishes) as spans
+- Keep the spans of the most recent cycles in memory
+- Summarize them: per-server and per-phase latency percentiles, slowest spans
+"""
+
+import math
+import time
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator
+
+import logging
+logger = logging.getLogger(__name__)
+
+# cycles kept in memory, whatever the number of servers (the timing page offers up to this many)
+TRACE_CYCLES = 50
+
+# phase name of the span covering a whole server sync
+SERVER_PHASE = "server"
+# phase name of the span covering a whole cycle (no server)
+CYCLE_PHASE = "cycle"
+
+
+@dataclass(frozen=True)
+class Span:
+    cycle: int
+    server: str | None
+    phase: str
+    started: float  # wall clock, for display
+    duration: float  # seconds
+    ok: bool
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of an ascending list.
+    """
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(durations: Iterable[float]) -> dict:
+    values = sorted(durations)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.50),
+        "p90": percentile(values, 0.90),
+        "p99": percentile(values, 0.99),
+        "max": values[-1] if values else 0.0,
+        "total": sum(values),
+    }
+
+
+class SyncTracer:
+    """
+    Collects spans from the sync worker threads.
+
+    The server (and the cycle it belongs to) is bound per thread with
+    `server()`, so nested helpers only have to name their phase.
+    """
+
+    def __init__(self, capacity: int = TRACE_CYCLES):
+        self.capacity = capacity
+        # cycle -> its spans, the last `capacity` cycles
+        self._cycles: Dict[int, list[Span]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.cycle = 0
+
+    def begin_cycle(self) -> int:
+        with self._lock:
+            self.cycle += 1
+            return self.cycle
+
+    def record(self, phase: str, duration: float, *, server: str | None = None, ok: bool = True) -> None:
+        cycle = getattr(self._local, "cycle", None)
+        if server is None:
+            server = getattr(self._local, "server", None)
+        span = Span(
+            cycle=self.cycle if cycle is None else cycle,
+            server=server,
+            phase=phase,
+            started=time.time() - duration,
+            duration=duration,
+            ok=ok,
+        )
+        with self._lock:
+            spans = self._cycles.get(span.cycle)
+            if spans is None:
+                if len(self._cycles) >= self.capacity and span.cycle < min(self._cycles):
+                    # late span of a cycle that was already evicted (an abandoned server)
+                    return
+                spans = self._cycles[span.cycle] = []
+                while len(self._cycles) > self.capacity:
+                    del self._cycles[min(self._cycles)]
+            spans.append(span)
+
+    @contextmanager
+    def span(self, phase: str, *, server: str | None = None) -> Iterator[None]:
+        """
+        Time the enclosed block; a span that raised is recorded as failed.
+        """
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(phase, time.perf_counter() - start, server=server, ok=ok)
+
+    @contextmanager
+    def server(self, name: str) -> Iterator[None]:
+        """
+        Bind the spans of the current thread to a server of the current cycle,
+        and time the whole server sync.
+        """
+        self._local.server = name
+        self._local.cycle = self.cycle
+        try:
+            with self.span(SERVER_PHASE):
+                yield
+        finally:
+            self._local.server = None
+            self._local.cycle = None
+
+    # ---------------------------------------------------------------
+    # Queries
+    # ---------------------------------------------------------------
+
+    def spans(self, last_cycles: int | None = None) -> list[Span]:
+        with self._lock:
+            current = self.cycle
+            first = None if last_cycles is None else current - last_cycles + 1
+            return [
+                s
+                for cycle, spans in sorted(self._cycles.items())
+                if first is None or cycle >= first
+                for s in spans
+            ]
+
+    def server_percentiles(self, last_cycles: int | None = None) -> Dict[str, dict]:
+        """
+        Per server: latency summary of whole server syncs, slowest first.
+        """
+        durations: Dict[str, list[float]] = {}
+        for s in self.spans(last_cycles):
+            if s.phase == SERVER_PHASE and s.server is not None:
+                durations.setdefault(s.server, []).append(s.duration)
+        result = {name: summarize(values) for name, values in durations.items()}
+        return dict(sorted(result.items(), key=lambda item: item[1]["p90"], reverse=True))
+
+    def phase_percentiles(self, last_cycles: int | None = None) -> Dict[str, dict]:
+        """
+        Per phase (all servers together): latency summary, largest total time first.
+        """
+        durations: Dict[str, list[float]] = {}
+        for s in self.spans(last_cycles):
+            if s.phase not in (SERVER_PHASE, CYCLE_PHASE):
+                durations.setdefault(s.phase, []).append(s.duration)
+        result = {phase: summarize(values) for phase, values in durations.items()}
+        return dict(sorted(result.items(), key=lambda item: item[1]["total"], reverse=True))
+
+    def slowest(self, last_cycles: int | None = None, limit: int = 20) -> list[Span]:
+        spans = [s for s in self.spans(last_cycles) if s.phase not in (SERVER_PHASE, CYCLE_PHASE)]
+        return sorted(spans, key=lambda s: s.duration, reverse=True)[:limit]
+
+
+tracer = SyncTracer()
@@ -0,0 +1,51 @@
+# tests/test_mqtt_commands.py
+import os
+import tempfile
+
+import pytest
+
+# storage reads the data root at import time
+os.environ.setdefault("TIMEKPR_MNGR_DATA_ROOT", tempfile.mkdtemp(prefix="timekpr-test-"))
+
+import ssh_sync
+
+
+@pytest.mark.parametrize("payload, seconds", [
+    (b"600", 600),
+    (b"-300", -300),
+    (b"900.0", 900),
+    (b'{"seconds": 60}', 60),
+])
+def test_command_seconds(payload, seconds):
+    assert ssh_sync._command_seconds(payload) == seconds
+
+
+@pytest.mark.parametrize("payload", [
+    b"Infinity",
+    b"-Infinity",
+    b"nan",
+    b"NaN",
+    b"1e999",
+    b"1.5",
+    b"true",
+    b'"600"',
+    b'{"seconds": null}',
+    str(ssh_sync.COMMAND_MAX_GRANT + 1).encode(),
+])
+def test_command_seconds_rejects(payload):
+    with pytest.raises(ValueError):
+        ssh_sync._command_seconds(payload)
+
+
+@pytest.mark.parametrize("payload", [b"Infinity", b"nan"])
+def test_non_finite_grant_publishes_a_rejection(monkeypatch, payload):
+    published = []
+    monkeypatch.setattr(ssh_sync, "load_servers", lambda: {"server1": {"users": {"kid": {}}}})
+    monkeypatch.setattr(ssh_sync, "publish", lambda topic, result, **kwargs: published.append((topic, result)))
+
+    ssh_sync._on_mqtt_command("command/server1/kid/grant_time", payload, False)
+
+    [(topic, result)] = published
+    assert topic == ssh_sync.COMMAND_RESULT_TOPIC
+    assert result["command"] == "command/server1/kid/grant_time"
+    assert result["ok"] is False and result["error"]
@@ -22,7 +22,7 @@ from storage import (
     pending_user_dir,
     pending_stats_dir,
 )
-from ssh_sync import trigger_ssh_sync
+from ssh_sync import trigger_ssh_sync, queue_extra_time
 
 import logging 
 logger = logging.getLogger(__name__)
@@ -160,7 +160,7 @@ def render_config_editor(
             content = serialize_config(lines, resolved)
             target.write_text(content)
             ui.notify('Saved locally (pending upload)', type='positive')
-            trigger_ssh_sync()
+            trigger_ssh_sync(server_name, username)
 
         with ui.column().classes('w-full max-w-3xl'):
             ui.label(source.name).classes('text-xl font-bold mb-2')
@@ -222,14 +222,6 @@ def render_config_editor(
 
 
 def add_user_extra_time(*, server_name: str, username: str, time_to_add_sec: int, playtime_to_add_sec: int):
-    target = pending_stats_dir(server_name) / f'{username}.stats'
-    lines = []
-    a_sign = "+" if time_to_add_sec >= 0 else "-"
-    lines.append(Line(raw=f'timekpra --settimeleft "{username}" "{a_sign}" "{abs(time_to_add_sec)}"'))
-    b_sign = "+" if playtime_to_add_sec >= 0 else "-"
-    lines.append(Line(raw=f'timekpra --setplaytimeleft "{username}" "{b_sign}" "{abs(playtime_to_add_sec)}"'))
-    
-    # Empty values dict as these lines are not Entry objects
-    target.write_text(serialize_config(lines, {}))
+    # summed with a grant that is not uploaded yet (e.g. one sent over MQTT)
+    queue_extra_time(server_name, username, time_to_add_sec, playtime_to_add_sec)
     ui.notify('Saved locally (pending upload)', type='positive')
-    trigger_ssh_sync()
@@ -8,6 +8,7 @@ from ssh_sync import change_upload_is_pending, trigger_ssh_sync, sync_heartbeat
 from ui.servers_page import servers_page
 from ui.config_editor import render_config_editor
 from ui.stats_dashboard import render_stats_dashboard
+from ui.sync_timing_page import render_sync_timing_page
 from storage import DATA_ROOT, get_admin_user_list, IS_EDGE 
 from datetime import datetime
 
@@ -43,6 +44,8 @@ def pending_ui():
         a_color = 'green'
         b_color = 'bg-green'
         b_text = f'Sync running, no upload pending  ({datetime.now().strftime("%H:%M")})'
+        if sync_heartbeat.last_duration is not None:
+            b_text += f', last cycle {sync_heartbeat.last_duration:.1f}s'
 
     with ui.icon('circle', color=a_color).classes('text-5xl'):
         ui.tooltip(b_text).classes(b_color)
@@ -76,6 +79,8 @@ def build_header():
             ui.link('Servers', '/servers').classes('font-bold text-brand')
             ui.link('pty', '/pty').classes('font-bold text-brand')
             ui.link('browse_folders', '/browse_folders').classes('font-bold text-brand')
+        if app.storage.user.get('is_admin', False):
+            ui.link('Sync timing', '/sync_timing').classes('font-bold text-brand')
         ui.space()
         ui.label(f"{app.storage.user.get('ha_username', "no user")}").classes('font-bold text-brand')
         with ui.icon('refresh', color=f'green').on('click', refresh_ssh_sync).classes('text-5xl cursor-pointer'):
@@ -102,6 +107,12 @@ def servers_page_wrapper():
     build_header()
     servers_page()
 
+@ui.page('/sync_timing')
+def sync_timing_page():
+    logger.info("sync_timing_page called")
+    build_header()
+    render_sync_timing_page()
+
 
 # Dynamically generate server pages
 servers = load_servers()
@@ -21,7 +21,7 @@ from servers import (
 )
 from storage import KEYS_DIR, create_backup, restore_backup, DATA_ROOT
 from ui.config_editor import add_user_extra_time
-from ssh_sync import servers_online
+from ssh_sync import servers_online, circuit_breakers
 
 import logging 
 logger = logging.getLogger(__name__)
@@ -370,7 +370,12 @@ def servers_page():
                     if servers_online.is_online(name):
                         ui.chip('ONLINE', color='green')
                     else:
-                        ui.chip('OFFLINE', color='gray')
+                        circuit = circuit_breakers.snapshot(name)
+                        with ui.chip('OFFLINE', color='gray'):
+                            if circuit['state'] == 'open':
+                                ui.tooltip(f"{circuit['failures']} failed attempts, next retry in {circuit['retry_in']}s")
+                            elif circuit['state'] == 'half_open':
+                                ui.tooltip('Trying to reconnect')
                 server_status()
                 refreshables.append(server_status)
                 if app.storage.user.get('is_admin', False): 
@@ -10,12 +10,14 @@ Responsibilities:
 
 from pathlib import Path
 from typing import Dict
-from datetime import datetime
+from datetime import date, datetime
 from nicegui import ui
 import plotly.graph_objects as go
 
 from stats_history import get_user_history
+from intraday_history import get_hourly_usage, get_sessions
 from storage import stats_cache_dir
+from stats_cache import stats_cache
 
 import logging 
 logger = logging.getLogger(__name__)
@@ -27,6 +29,7 @@ logger = logging.getLogger(__name__)
 UNIFIED_CARD_WIDTH = 'w-full sm:w-48'
 CHART_CARD_WIDTH = 'w-full sm:w-[450px]' # Wider for better display
 FIXED_HEIGHT = 'h-[250px]' # Define a consistent height
+HISTORY_CHART_DAYS = 30 # the history keeps more, the chart stays readable
 
 # -------------------------------------------------------------------
 # Parsing helpers
@@ -69,9 +72,8 @@ def _parse_stats(text: str) -> Dict[str, float]:
 
 def _load_stats(server_name: str, username: str) -> Dict[str, float]:
     path = stats_cache_dir(server_name) / f'{username}.stats'
-    if not path.exists():
-        return {}
-    return _parse_stats(path.read_text())
+    # parsed once per file change, shared with the sync loop
+    return stats_cache.get(path, _parse_stats) or {}
 
 
 # -------------------------------------------------------------------
@@ -97,15 +99,7 @@ def _stat_card(title: str, value: str, icon: str):
         ui.label(value).classes('text-xl font-bold')
 
 
-def _render_usage_history_chart(server_name: str, username: str):
-    # Hide the Plotly modebar via CSS (the most reliable method)
-    ui.add_head_html('<style>.modebar { display: none !important; }</style>')
-
-    history = get_user_history(server_name, username)
-    if not history:
-        ui.label('No data').classes('text-gray p-4 text-xs')
-        return
-
+def _build_usage_history_figure(history: dict[str, dict]) -> go.Figure:
     raw_dates = list(history.keys())
     
     # POLISH: Shorten dates (e.g., "2026-02-03" -> "03 Feb")
@@ -175,6 +169,105 @@ def _render_usage_history_chart(server_name: str, username: str):
         dragmode=False,
     )
 
+    return fig
+
+
+def _build_hourly_usage_figure(hourly: list[tuple[int, int]]) -> go.Figure:
+    hours = [f"{hour:02d}" for hour in range(24)]
+    time_spent = [t / 60 for t, _ in hourly]
+    playtime_spent = [p / 60 for _, p in hourly]
+
+    fig = go.Figure()
+    fig.add_bar(
+        x=hours,
+        y=time_spent,
+        name=" Time",
+        marker_color='rgba(56, 189, 248, 0.3)',
+        marker_line_width=0,
+        hovertemplate='%{x}h: %{y:.0f} min<extra></extra>'
+    )
+    fig.add_bar(
+        x=hours,
+        y=playtime_spent,
+        name="PlayTime",
+        marker_color='rgba(52, 211, 153, 0.7)',
+        marker_line_width=0,
+        hovertemplate='%{x}h play: %{y:.0f} min<extra></extra>'
+    )
+
+    # same look as the daily history chart
+    fig.update_layout(
+        template="plotly_dark",
+        paper_bgcolor="rgba(0,0,0,0)",
+        plot_bgcolor="rgba(0,0,0,0)",
+        barmode="overlay",
+        bargap=0.2,
+        height=200,
+        margin=dict(l=10, r=10, t=30, b=30),
+        xaxis=dict(
+            showgrid=False,
+            showline=False,
+            fixedrange=True,
+            tickfont=dict(size=10, color="#94a3b8"),
+            type='category',
+            tickvals=hours[::3],
+        ),
+        yaxis=dict(
+            showgrid=False,
+            showticklabels=False,
+            fixedrange=True,
+            zeroline=False,
+            range=[0, 60],
+        ),
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.1,
+            xanchor="center",
+            x=0.5,
+            font=dict(size=10, color="#64748b")
+        ),
+        hovermode="x unified",
+        dragmode=False,
+    )
+
+    return fig
+
+
+def _render_hourly_usage_chart(server_name: str, username: str):
+    hourly = get_hourly_usage(server_name, username, date.today())
+    if not any(t or p for t, p in hourly):
+        ui.label('No data').classes('text-gray p-4 text-xs')
+        return
+
+    chart = ui.plotly(_build_hourly_usage_figure(hourly)).classes("w-full").style('height: 180px; margin-top: 10px;')
+    chart._props['config'] = {'displayModeBar': False}
+    chart.update()
+
+
+def _render_sessions(server_name: str, username: str):
+    sessions = get_sessions(server_name, username, date.today())
+    if not sessions:
+        ui.label('No sessions yet').classes('text-gray p-4 text-xs')
+        return
+
+    with ui.column().classes('w-full gap-1 p-2 overflow-auto'):
+        for session in sessions:
+            span = f"{session['start'].strftime('%H:%M')} - {session['end'].strftime('%H:%M')}"
+            ui.label(f"{span}  ({_seconds_to_human(session['time_spent'])})").classes('text-sm')
+
+
+def _render_usage_history_chart(server_name: str, username: str):
+    # Hide the Plotly modebar via CSS (the most reliable method)
+    ui.add_head_html('<style>.modebar { display: none !important; }</style>')
+
+    history = get_user_history(server_name, username, days=HISTORY_CHART_DAYS)
+    if not history:
+        ui.label('No data').classes('text-gray p-4 text-xs')
+        return
+
+    fig = _build_usage_history_figure(history)
+
     # Render the chart and ensure height is fixed via CSS
     chart = ui.plotly(fig).classes("w-full").style('height: 180px; margin-top: 10px;')
     
@@ -211,8 +304,17 @@ def render_stats_dashboard(server_name: str, username: str):
             ui.label("Last 7 Days").classes('text-sm font-bold m-2 text-center')
             _render_usage_history_chart(server_name, username)
 
+        # 3. Intraday: usage per hour and sessions of today
+        with ui.card().classes(f'{CHART_CARD_WIDTH} {FIXED_HEIGHT} p-0 overflow-hidden'):
+            ui.label("Today by Hour").classes('text-sm font-bold m-2 text-center')
+            _render_hourly_usage_chart(server_name, username)
+
+        with ui.card().classes(f'{UNIFIED_CARD_WIDTH} {FIXED_HEIGHT} p-0 overflow-hidden'):
+            ui.label("Sessions Today").classes('text-sm font-bold m-2 text-center')
+            _render_sessions(server_name, username)
+
     with ui.row().classes('w-full flex-wrap gap-4 mt-4 justify-center md:justify-start'):
-        # 3. Time Stats
+        # 4. Time Stats
         if 'TIME_SPENT_BALANCE' in stats:
             _stat_card('Balance Today', _seconds_to_human(stats['TIME_SPENT_BALANCE']), icon='scale')
 
@@ -226,7 +328,7 @@ def render_stats_dashboard(server_name: str, username: str):
             _stat_card('Total Month', _seconds_to_human(stats['TIME_SPENT_MONTH']), icon='calendar_month')
 
     with ui.row().classes('w-full flex-wrap gap-4 mt-4 justify-center md:justify-start'):
-        # 4. Playtime Stats
+        # 5. Playtime Stats
         if 'PLAYTIME_SPENT_BALANCE' in stats:
             _stat_card('Play Balance', _seconds_to_human(stats['PLAYTIME_SPENT_BALANCE']), icon='videogame_asset')
 
@@ -0,0 +1,122 @@
+# ui/sync_timing_page.py
+"""
+Sync timing UI.
+
+Responsibilities:
+- Show where the sync cycles spend their time, from the in-memory trace
+- Slowest servers and phases (latency percentiles) over the last N cycles
+- Slowest individual spans
+"""
+
+from datetime import datetime
+from nicegui import app, ui
+
+from sync_trace import tracer, CYCLE_PHASE, TRACE_CYCLES, summarize
+
+import logging
+logger = logging.getLogger(__name__)
+
+# the trace keeps TRACE_CYCLES cycles
+CYCLE_CHOICES = [5, 20, TRACE_CYCLES]
+
+
+def _seconds(value: float) -> str:
+    return f"{value:.2f}s"
+
+
+def _summary_rows(summaries: dict, key_name: str) -> list[dict]:
+    return [
+        {
+            key_name: key,
+            "count": s["count"],
+            "p50": _seconds(s["p50"]),
+            "p90": _seconds(s["p90"]),
+            "p99": _seconds(s["p99"]),
+            "max": _seconds(s["max"]),
+            "total": _seconds(s["total"]),
+        }
+        for key, s in summaries.items()
+    ]
+
+
+def _summary_columns(key_name: str, label: str) -> list[dict]:
+    columns = [{"name": key_name, "label": label, "field": key_name, "align": "left"}]
+    for name in ("count", "p50", "p90", "p99", "max", "total"):
+        columns.append({"name": name, "label": name, "field": name})
+    return columns
+
+
+def render_sync_timing_page():
+    if not app.storage.user.get('is_admin', False):
+        ui.label("No rights for this page")
+        return
+
+    logger.info("sync timing page generation is started")
+    selection = {"cycles": CYCLE_CHOICES[1]}
+
+    @ui.refreshable
+    def timing_tables():
+        cycles = selection["cycles"]
+        spans = tracer.spans(cycles)
+        if not spans:
+            ui.label('No sync cycle traced yet').classes('text-gray-500')
+            return
+
+        cycle_summary = summarize(s.duration for s in spans if s.phase == CYCLE_PHASE)
+        ui.label(
+            f"{cycle_summary['count']} cycle(s): p50 {_seconds(cycle_summary['p50'])}, "
+            f"p90 {_seconds(cycle_summary['p90'])}, max {_seconds(cycle_summary['max'])}"
+        ).classes('text-lg')
+
+        ui.label('Slowest servers').classes('text-lg font-semibold mt-4')
+        ui.table(
+            columns=_summary_columns("server", "Server"),
+            rows=_summary_rows(tracer.server_percentiles(cycles), "server"),
+            row_key="server",
+        ).classes('w-full')
+
+        ui.label('Slowest phases').classes('text-lg font-semibold mt-4')
+        ui.table(
+            columns=_summary_columns("phase", "Phase"),
+            rows=_summary_rows(tracer.phase_percentiles(cycles), "phase"),
+            row_key="phase",
+        ).classes('w-full')
+
+        ui.label('Slowest spans').classes('text-lg font-semibold mt-4')
+        ui.table(
+            columns=[
+                {"name": "started", "label": "Started", "field": "started", "align": "left"},
+                {"name": "server", "label": "Server", "field": "server", "align": "left"},
+                {"name": "phase", "label": "Phase", "field": "phase", "align": "left"},
+                {"name": "duration", "label": "Duration", "field": "duration"},
+                {"name": "ok", "label": "OK", "field": "ok"},
+            ],
+            rows=[
+                {
+                    "id": i,
+                    "started": datetime.fromtimestamp(s.started).strftime('%H:%M:%S'),
+                    "server": s.server or "-",
+                    "phase": s.phase,
+                    "duration": _seconds(s.duration),
+                    "ok": "yes" if s.ok else "no",
+                }
+                for i, s in enumerate(tracer.slowest(cycles))
+            ],
+            row_key="id",
+        ).classes('w-full')
+
+    def select_cycles(e):
+        selection["cycles"] = e.value
+        timing_tables.refresh()
+
+    with ui.column().classes('w-full max-w-5xl'):
+        with ui.row().classes('w-full items-center'):
+            ui.label('Sync timing').classes('text-2xl font-bold')
+            ui.space()
+            ui.select(
+                options={n: f'last {n} cycles' for n in CYCLE_CHOICES},
+                value=selection["cycles"],
+                on_change=select_cycles,
+            )
+            ui.button(icon='refresh', on_click=timing_tables.refresh).props('flat')
+        timing_tables()